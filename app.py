@@ -1,8 +1,10 @@
 import streamlit as st
 import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
 from main import (
     speak_response,
+    speak_in_background,
     get_microphone_list,
     listen_for_speech,
     find_preferred_microphone,
@@ -10,9 +12,21 @@ from main import (
     create_user_profile,
     create_session_id,
     test_api_keys,
-    initialize_elevenlabs
+    initialize_elevenlabs,
+    prewarm_connections,
+    load_conversation_history,
+    thread_exists,
+    get_session_store,
+    resume_or_create_session,
+    record_session,
+    HISTORY_PAGE_SIZE
 )
-from langchain.schema import HumanMessage, AIMessage
+from audio import AUDIO_TRANSPORT, transcribe_audio
+from tts import speak_audio
+from crisis import CRISIS_RESPONSE
+from transcript import Transcript
+
+_crisis_audio_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="crisis-audio")
 
 st.set_page_config(
     page_title="AI Therapy Assistant",
@@ -150,12 +164,16 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 def initialize_session_state():
+    if 'session_token' not in st.session_state:
+        st.session_state.session_token = None
     if 'user_id' not in st.session_state:
         st.session_state.user_id = None
     if 'session_id' not in st.session_state:
         st.session_state.session_id = None
     if 'conversation_history' not in st.session_state:
-        st.session_state.conversation_history = []
+        st.session_state.conversation_history = Transcript()
+    if 'history_start' not in st.session_state:
+        st.session_state.history_start = 0
     if 'is_authenticated' not in st.session_state:
         st.session_state.is_authenticated = False
     if 'selected_mic' not in st.session_state:
@@ -164,6 +182,16 @@ def initialize_session_state():
         st.session_state.tts_enabled = True
     if 'listening' not in st.session_state:
         st.session_state.listening = False
+    if 'pending_audio' not in st.session_state:
+        st.session_state.pending_audio = None
+    if 'crisis_audio' not in st.session_state:
+        st.session_state.crisis_audio = None
+    if 'crisis_notice' not in st.session_state:
+        st.session_state.crisis_notice = None
+    if 'pending_crisis_audio' not in st.session_state:
+        st.session_state.pending_crisis_audio = None
+    if 'voice_input_round' not in st.session_state:
+        st.session_state.voice_input_round = 0
 
     if 'api_keys_set' not in st.session_state:
         st.session_state.api_keys_set = False
@@ -174,6 +202,36 @@ def initialize_session_state():
     if 'elevenlabs_client' not in st.session_state:
         st.session_state.elevenlabs_client = None
 
+def persist_session():
+    if st.session_state.session_token is None:
+        st.session_state.session_token = uuid.uuid4().hex
+    get_session_store().save(st.session_state.session_token, {
+        "user_id": st.session_state.user_id,
+        "session_id": st.session_state.session_id,
+        "tts_enabled": st.session_state.tts_enabled
+    })
+    st.query_params["session"] = st.session_state.session_token
+
+def restore_session():
+    token = st.query_params.get("session")
+    if st.session_state.is_authenticated or not token:
+        return
+    
+    data = get_session_store().load(token)
+    if not data:
+        return
+    
+    st.session_state.session_token = token
+    st.session_state.user_id = data["user_id"]
+    st.session_state.session_id = data["session_id"]
+    st.session_state.tts_enabled = data.get("tts_enabled", True)
+    # Brings the thread back from the archive if retention moved it there.
+    thread_exists(data["session_id"])
+    st.session_state.conversation_history, st.session_state.history_start = load_conversation_history(
+        data["session_id"], page_size=HISTORY_PAGE_SIZE
+    )
+    st.session_state.is_authenticated = True
+
 def setup_api_keys():
     st.sidebar.header("🔑 API Keys Setup")
     
@@ -203,6 +261,7 @@ def setup_api_keys():
                     valid, errors = test_api_keys(openai_key.strip(), elevenlabs_key.strip())
                 
                 if valid:
+                    prewarm_connections()
                     elevenlabs_client, tts_success, tts_message = initialize_elevenlabs(elevenlabs_key.strip())
                     
                     st.session_state.openai_key = openai_key.strip()
@@ -271,6 +330,8 @@ def authenticate_user():
                     st.session_state.user_id = user_id
                     st.session_state.session_id = create_session_id(user_id)  # Using main.py function
                     st.session_state.is_authenticated = True
+                    record_session(user_id, st.session_state.session_id)
+                    persist_session()
                     st.sidebar.success(f"Profile created! Welcome {user_name}!")
                     st.rerun()
                 else:
@@ -280,9 +341,16 @@ def authenticate_user():
             user_id = st.sidebar.text_input("Enter your User ID:")
             if st.sidebar.button("Login"):
                 if user_id.strip():
+                    session_id, resumed = resume_or_create_session(user_id.strip())
                     st.session_state.user_id = user_id.strip()
-                    st.session_state.session_id = create_session_id(user_id)  # Using main.py function
+                    st.session_state.session_id = session_id
+                    if resumed:
+                        st.session_state.conversation_history, st.session_state.history_start = load_conversation_history(
+                            session_id, page_size=HISTORY_PAGE_SIZE
+                        )
                     st.session_state.is_authenticated = True
+                    record_session(st.session_state.user_id, session_id)
+                    persist_session()
                     st.sidebar.success("Welcome back!")
                     st.rerun()
                 else:
@@ -297,6 +365,9 @@ def authenticate_user():
         
         if st.sidebar.button("Logout"):
 
+            if st.session_state.session_token:
+                get_session_store().delete(st.session_state.session_token)
+            st.query_params.clear()
             for key in list(st.session_state.keys()):
                 del st.session_state[key]
             st.rerun()
@@ -307,8 +378,10 @@ def setup_voice_controls():
     st.sidebar.header("🎙️ Voice Controls")
     
 
-    mic_names = get_microphone_list()
-    if mic_names:
+    mic_names = get_microphone_list() if AUDIO_TRANSPORT == "local" else []
+    if AUDIO_TRANSPORT != "local":
+        st.session_state.selected_mic = None
+    elif mic_names:
 
         default_index = find_preferred_microphone(mic_names, "OnePlus Buds 3")
         if default_index is None:
@@ -330,34 +403,114 @@ def setup_voice_controls():
         value=st.session_state.tts_enabled
     )
 
+def speak(text):
+    if AUDIO_TRANSPORT == "local":
+        speak_response(text, st.session_state.elevenlabs_client)
+        return
+    try:
+        st.session_state.pending_audio = speak_audio(text, st.session_state.elevenlabs_client)
+    except Exception:
+        st.session_state.pending_audio = None
+
+def play_pending_audio(autoplay=True):
+    if st.session_state.pending_audio:
+        audio, mime = st.session_state.pending_audio
+        st.audio(audio, format=mime, autoplay=autoplay)
+        st.session_state.pending_audio = None
+
+def show_crisis_resources(crisis_text):
+    # Drawn at once while the reply is still being generated; the session-state copy redraws it after the rerun.
+    st.error(f"🆘 {crisis_text}")
+    st.session_state.crisis_notice = crisis_text
+    if not (st.session_state.tts_enabled and st.session_state.elevenlabs_client):
+        return
+    if AUDIO_TRANSPORT == "local":
+        speak_in_background(crisis_text, st.session_state.elevenlabs_client)
+        return
+    if crisis_text == CRISIS_RESPONSE and st.session_state.crisis_audio is not None:
+        st.session_state.pending_crisis_audio = st.session_state.crisis_audio
+    else:
+        # Synthesized alongside the LLM call instead of in front of it.
+        st.session_state.pending_crisis_audio = _crisis_audio_executor.submit(
+            speak_audio, crisis_text, st.session_state.elevenlabs_client
+        )
+
+def play_crisis_resources():
+    if st.session_state.crisis_notice:
+        st.error(f"🆘 {st.session_state.crisis_notice}")
+    pending, st.session_state.pending_crisis_audio = st.session_state.pending_crisis_audio, None
+    if isinstance(pending, Future):
+        try:
+            pending = pending.result()
+        except Exception:
+            return False
+        if st.session_state.crisis_notice == CRISIS_RESPONSE:
+            st.session_state.crisis_audio = pending
+    if not pending:
+        return False
+    audio, mime = pending
+    st.audio(audio, format=mime, autoplay=True)
+    return True
+
+def handle_voice_turn(speech_text):
+    with st.spinner("AI Therapist is thinking..."):
+        response, ai_success = get_ai_response(speech_text)
+    
+
+    if st.session_state.tts_enabled and ai_success and response and st.session_state.elevenlabs_client:
+        with st.spinner("Speaking response..."):
+            speak(response)
+    
+    st.rerun()
+
 def get_ai_response(user_message):
+    st.session_state.crisis_notice = None
     response, success = get_therapy_response(
         user_message, 
         st.session_state.conversation_history, 
         st.session_state.user_id, 
         st.session_state.session_id,
-        st.session_state.openai_key
+        st.session_state.openai_key,
+        on_crisis=show_crisis_resources
     )
+    if st.session_state.session_token:
+        get_session_store().touch(st.session_state.session_token)
+    record_session(st.session_state.user_id, st.session_state.session_id)
     return response, success
 
+def load_earlier_messages():
+    older, start = load_conversation_history(
+        st.session_state.session_id,
+        before=st.session_state.history_start,
+        page_size=HISTORY_PAGE_SIZE
+    )
+    st.session_state.conversation_history.prepend(older)
+    st.session_state.history_start = start
+
 def display_chat_history():
+    if st.session_state.history_start > 0:
+        if st.button("⬆️ Load earlier messages", use_container_width=True):
+            load_earlier_messages()
+            st.rerun()
+    
     if st.session_state.conversation_history:
-        for message in st.session_state.conversation_history:
-            if isinstance(message, HumanMessage):
+        for role, content in st.session_state.conversation_history:
+            if role == "user":
                 st.markdown(f"""
                 <div class="chat-message user-message">
-                    <strong>You:</strong> {message.content}
+                    <strong>You:</strong> {content}
                 </div>
                 """, unsafe_allow_html=True)
-            elif isinstance(message, AIMessage):
+            else:
                 st.markdown(f"""
                 <div class="chat-message assistant-message">
-                    <strong>AI Therapist:</strong> {message.content}
+                    <strong>AI Therapist:</strong> {content}
                 </div>
                 """, unsafe_allow_html=True)
 
 def main():
     initialize_session_state()
+    restore_session()
     
 
     st.markdown("""
@@ -429,53 +582,61 @@ def main():
         """, unsafe_allow_html=True)
         
 
-        col_listen, col_stop = st.columns([1, 1])
+        if AUDIO_TRANSPORT == "local":
+            col_listen, col_stop = st.columns([1, 1])
         
-        with col_listen:
-            if st.button("🎙️ Start Listening", use_container_width=True, disabled=st.session_state.listening):
-                if st.session_state.selected_mic is not None:
-                    st.session_state.listening = True
+            with col_listen:
+                if st.button("🎙️ Start Listening", use_container_width=True, disabled=st.session_state.listening):
+                    if st.session_state.selected_mic is not None:
+                        st.session_state.listening = True
                     
 
-                    listening_placeholder = st.empty()
-                    listening_placeholder.markdown("""
-                    <div class="listening-indicator">
-                        🎙️ Listening... Speak now!
-                    </div>
-                    """, unsafe_allow_html=True)
+                        listening_placeholder = st.empty()
+                        listening_placeholder.markdown("""
+                        <div class="listening-indicator">
+                            🎙️ Listening... Speak now!
+                        </div>
+                        """, unsafe_allow_html=True)
                     
 
-                    with st.spinner("Processing speech..."):
-                        speech_text, success, message = listen_for_speech(st.session_state.selected_mic)
+                        with st.spinner("Processing speech..."):
+                            speech_text, success, message = listen_for_speech(st.session_state.selected_mic)
                     
-                    listening_placeholder.empty()
-                    st.session_state.listening = False
+                        listening_placeholder.empty()
+                        st.session_state.listening = False
                     
-                    if success:
-
-                        with st.spinner("AI Therapist is thinking..."):
-                            response, ai_success = get_ai_response(speech_text)
-                        
-
-                        if st.session_state.tts_enabled and ai_success and st.session_state.elevenlabs_client:
-                            with st.spinner("Speaking response..."):
-                                speak_response(response, st.session_state.elevenlabs_client)
-                        
-                        st.rerun()
+                        if success:
+                            handle_voice_turn(speech_text)
+                        else:
+                            st.error(message)
                     else:
-                        st.error(message)
-                else:
-                    st.error("Please select a microphone first!")
+                        st.error("Please select a microphone first!")
         
-        with col_stop:
-            if st.button("⏹️ Stop", use_container_width=True, disabled=not st.session_state.listening):
-                st.session_state.listening = False
-                st.rerun()
+            with col_stop:
+                if st.button("⏹️ Stop", use_container_width=True, disabled=not st.session_state.listening):
+                    st.session_state.listening = False
+                    st.rerun()
+        else:
+            recording = st.audio_input(
+                "🎙️ Record your message",
+                key=f"voice_input_{st.session_state.voice_input_round}"
+            )
+            if recording is not None:
+                with st.spinner("Processing speech..."):
+                    speech_text, success, message = transcribe_audio(recording.getvalue())
+                st.session_state.voice_input_round += 1
+                
+                if success:
+                    handle_voice_turn(speech_text)
+                else:
+                    st.error(message)
         
 
         chat_container = st.container()
         with chat_container:
             display_chat_history()
+            # The reply waits for a click when the crisis resources are already playing.
+            play_pending_audio(autoplay=not play_crisis_resources())
         
 
         st.markdown("#### Type your message:")
@@ -494,9 +655,9 @@ def main():
                         response, success = get_ai_response(user_input)
                     
 
-                    if st.session_state.tts_enabled and success and st.session_state.elevenlabs_client:
+                    if st.session_state.tts_enabled and success and response and st.session_state.elevenlabs_client:
                         with st.spinner("Speaking response..."):
-                            speak_response(response, st.session_state.elevenlabs_client)
+                            speak(response)
                     
                     st.rerun()
                 else:
@@ -504,16 +665,19 @@ def main():
         
         with col_clear:
             if st.button("🗑️ Clear Chat", use_container_width=True):
-                st.session_state.conversation_history = []
+                st.session_state.conversation_history.clear()
+                st.session_state.history_start = 0
+                st.session_state.crisis_notice = None
                 st.rerun()
         
         with col_speak:
             if st.button("🔊 Replay Last", use_container_width=True):
                 if st.session_state.conversation_history and st.session_state.tts_enabled and st.session_state.elevenlabs_client:
-                    last_msg = st.session_state.conversation_history[-1]
-                    if isinstance(last_msg, AIMessage):
+                    last_role, last_content = st.session_state.conversation_history.last()
+                    if last_role == "assistant":
                         with st.spinner("Speaking..."):
-                            speak_response(last_msg.content, st.session_state.elevenlabs_client)
+                            speak(last_content)
+                        play_pending_audio()
                 else:
                     st.warning("No AI response to replay or TTS disabled.")
     
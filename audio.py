@@ -0,0 +1,135 @@
+from dotenv import load_dotenv
+import io
+import os
+import tempfile
+import threading
+import wave
+import speech_recognition as sr
+from clients import ELEVENLABS_VOICE_ID, ELEVENLABS_MODEL_ID, ELEVENLABS_OUTPUT_FORMAT, client_key_digest
+from scheduler import INTERACTIVE, schedule
+from singleflight import content_key, flight
+
+load_dotenv()
+
+AUDIO_TRANSPORT = os.getenv("AUDIO_TRANSPORT", "browser")
+LOCAL_TTS_ENGINE = os.getenv("LOCAL_TTS_ENGINE", "pyttsx3")
+
+DEFAULT_PROFILE = {
+    "name": "default",
+    "model_id": ELEVENLABS_MODEL_ID,
+    "output_format": ELEVENLABS_OUTPUT_FORMAT,
+    "latency": 0,
+}
+
+MIME_TYPES = {
+    "mp3": "audio/mpeg",
+    "pcm": "audio/L16",
+    "ulaw": "audio/basic",
+    "opus": "audio/ogg",
+}
+
+
+def audio_mime_type(output_format=ELEVENLABS_OUTPUT_FORMAT):
+    kind, _, rate = output_format.partition("_")
+    if kind == "pcm" and rate:
+        return f"{MIME_TYPES['pcm']};rate={rate}"
+    return MIME_TYPES.get(kind, "application/octet-stream")
+
+def sniff_mime_type(audio, default=None):
+    if audio[:4] == b"RIFF":
+        return "audio/wav"
+    if audio[:3] == b"ID3" or audio[:2] in (b"\xff\xfb", b"\xff\xf3", b"\xff\xf2"):
+        return "audio/mpeg"
+    if audio[:4] == b"OggS":
+        return "audio/ogg"
+    return default or audio_mime_type()
+
+def pcm_to_wav(pcm, output_format):
+    # Raw PCM is the cheapest format to produce and decode; a WAV header makes it playable anywhere.
+    rate = int(output_format.partition("_")[2] or 16000)
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(pcm)
+    return buffer.getvalue()
+
+def _tts_request(profile, text):
+    request = {
+        "voice_id": ELEVENLABS_VOICE_ID,
+        "output_format": profile["output_format"],
+        "text": text,
+        "model_id": profile["model_id"],
+    }
+    if profile.get("latency"):
+        request["optimize_streaming_latency"] = profile["latency"]
+    return request
+
+def tts_key(text, profile=DEFAULT_PROFILE, elevenlabs_client=None):
+    # The caller's key is part of the identity: only requests billed to the same account are merged.
+    return content_key(
+        "tts", client_key_digest(elevenlabs_client), ELEVENLABS_VOICE_ID, profile["model_id"],
+        profile["output_format"], profile.get("latency", 0), text,
+    )
+
+def _relay(first, chunks):
+    # A generator rather than itertools.chain, so closing it (when every listener has gone) closes
+    # the HTTP response too.
+    try:
+        yield first
+        yield from chunks
+    finally:
+        close = getattr(chunks, "close", None)
+        if close:
+            close()
+
+def synthesize_stream(text, elevenlabs_client, session="default", priority=INTERACTIVE, profile=DEFAULT_PROFILE):
+    def open_stream():
+        chunks = iter(elevenlabs_client.text_to_speech.stream(**_tts_request(profile, text)))
+        # The request is only sent on first iteration, so pull the first chunk under admission control.
+        return _relay(next(chunks, b""), chunks)
+
+    return flight.stream(
+        tts_key(text, profile, elevenlabs_client),
+        lambda: schedule("elevenlabs", open_stream, session=session, priority=priority, tokens=len(text)),
+    )
+
+
+_local_lock = threading.Lock()
+
+def local_tts_available():
+    if LOCAL_TTS_ENGINE != "pyttsx3":
+        return False
+    try:
+        import pyttsx3
+        return True
+    except ImportError:
+        return False
+
+def synthesize_local(text):
+    import pyttsx3
+
+    # pyttsx3 drives a single platform speech engine, so calls are serialised.
+    with _local_lock, tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "speech.wav")
+        engine = pyttsx3.init()
+        engine.save_to_file(text, path)
+        engine.runAndWait()
+        engine.stop()
+        with open(path, "rb") as f:
+            return f.read()
+
+def transcribe_audio(audio_bytes):
+    try:
+        r = sr.Recognizer()
+        with sr.AudioFile(io.BytesIO(audio_bytes)) as source:
+            audio = r.record(source)
+        text = r.recognize_google(audio)
+        return text, True, "Success"
+    except sr.UnknownValueError:
+        return "", False, "Could not understand audio"
+    except sr.RequestError as e:
+        return "", False, f"Speech recognition error: {e}"
+    except Exception as e:
+        return "", False, f"Error: {e}"
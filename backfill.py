@@ -0,0 +1,234 @@
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from langchain.schema import HumanMessage, AIMessage
+from langgraph.checkpoint.sqlite import SqliteSaver
+import argparse
+import logging
+import os
+import threading
+import time
+from graph import MEMORY_COLLECTION, MEMORY_EMBEDDING_MODEL, create_memory
+from retrieval import count_tokens
+from scheduler import BACKGROUND, schedule
+from state_backend import CHECKPOINT_URL, connect_sqlite, sqlite_path
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_WORKERS = int(os.getenv("BACKFILL_WORKERS", "8"))
+BACKFILL_BATCH_TURNS = int(os.getenv("BACKFILL_BATCH_TURNS", "8"))
+BACKFILL_REPORT_INTERVAL = float(os.getenv("BACKFILL_REPORT_INTERVAL", "5"))
+
+WATERMARK_SCHEMA = """
+CREATE TABLE IF NOT EXISTS memory_backfill (
+    target TEXT NOT NULL,
+    thread_id TEXT NOT NULL,
+    messages_done INTEGER NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (target, thread_id)
+)
+"""
+
+
+class Watermarks:
+    def __init__(self, conn, target):
+        self.conn = conn
+        self.target = target
+        self.lock = threading.Lock()
+        with self.lock:
+            self.conn.execute(WATERMARK_SCHEMA)
+            self.conn.commit()
+
+    def get(self, thread_id):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT messages_done FROM memory_backfill WHERE target = ? AND thread_id = ?",
+                (self.target, thread_id),
+            ).fetchone()
+        return row[0] if row else 0
+
+    def set(self, thread_id, messages_done):
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO memory_backfill (target, thread_id, messages_done, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (target, thread_id) DO UPDATE SET messages_done = excluded.messages_done, "
+                "updated_at = excluded.updated_at",
+                (self.target, thread_id, messages_done, time.time()),
+            )
+            self.conn.commit()
+
+    def reset(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM memory_backfill WHERE target = ?", (self.target,))
+            self.conn.commit()
+
+
+class Progress:
+    def __init__(self, total_threads):
+        self.total_threads = total_threads
+        self.threads = 0
+        self.skipped = 0
+        self.batches = 0
+        self.messages = 0
+        self.tokens = 0
+        self.errors = 0
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+
+    def add(self, **counts):
+        with self.lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def report(self, final=False):
+        with self.lock:
+            elapsed = max(time.monotonic() - self.started, 1e-9)
+            finished = self.threads + self.skipped
+            rate = self.threads / elapsed
+            remaining = (self.total_threads - finished) / rate if rate and not final else 0.0
+            print(f"{'done' if final else 'progress'}: {finished}/{self.total_threads} threads "
+                  f"({self.skipped} up to date, {self.errors} errors)  {self.batches} batches  "
+                  f"{self.messages} messages  {self.messages / elapsed:.1f} msg/s  "
+                  f"{self.tokens / elapsed * 60:.0f} tokens/min  elapsed {elapsed:.0f}s"
+                  + ("" if final else f"  eta {remaining:.0f}s"), flush=True)
+
+
+def iter_threads(conn):
+    # Stream thread ids from a cursor rather than loading the full list.
+    for (thread_id,) in conn.execute("SELECT DISTINCT thread_id FROM checkpoints WHERE checkpoint_ns = ''"):
+        yield thread_id
+
+def count_threads(conn):
+    return conn.execute("SELECT COUNT(DISTINCT thread_id) FROM checkpoints WHERE checkpoint_ns = ''").fetchone()[0]
+
+def load_transcript(saver, thread_id):
+    saved = saver.get_tuple({"configurable": {"thread_id": thread_id}})
+    if saved is None:
+        return None, []
+    values = saved.checkpoint.get("channel_values", {})
+    return values.get("user_id"), values.get("messages", [])
+
+def turn_batches(messages, start=0, batch_turns=BACKFILL_BATCH_TURNS):
+    # Each batch ends on an assistant reply so a turn is never split across two mem0 calls.
+    batch, turns = [], 0
+    for index in range(start, len(messages)):
+        message = messages[index]
+        if isinstance(message, AIMessage):
+            batch.append({"role": "assistant", "content": message.content})
+            turns += 1
+            if turns >= batch_turns:
+                yield index + 1, batch
+                batch, turns = [], 0
+        elif isinstance(message, HumanMessage):
+            batch.append({"role": "user", "content": message.content})
+    if turns:
+        yield len(messages), batch
+
+
+class Backfill:
+    def __init__(self, db_path, collection=MEMORY_COLLECTION, embedding_model=MEMORY_EMBEDDING_MODEL,
+                 api_key=None, workers=BACKFILL_WORKERS, batch_turns=BACKFILL_BATCH_TURNS, dry_run=False):
+        self.db_path = db_path
+        self.api_key = api_key or os.getenv("OPENAI_API_KEY")
+        self.collection = collection
+        self.embedding_model = embedding_model
+        self.workers = workers
+        self.batch_turns = batch_turns
+        self.dry_run = dry_run
+        self.saver = SqliteSaver(connect_sqlite(db_path))
+        self.watermarks = Watermarks(connect_sqlite(db_path), collection)
+        self._local = threading.local()
+
+    def memory(self):
+        # One mem0 client per worker thread; its history store is not safe to share.
+        if getattr(self._local, "memory", None) is None:
+            self._local.memory = create_memory(self.api_key, self.collection, self.embedding_model)
+            if self._local.memory is None:
+                raise RuntimeError(f"memory store unavailable for collection {self.collection}")
+        return self._local.memory
+
+    def backfill_thread(self, thread_id, progress):
+        user_id, messages = load_transcript(self.saver, thread_id)
+        done = self.watermarks.get(thread_id)
+        if not user_id or done >= len(messages):
+            progress.add(skipped=1)
+            return
+
+        for end, batch in turn_batches(messages, done, self.batch_turns):
+            tokens = sum(count_tokens(str(m["content"])) for m in batch)
+            if not self.dry_run:
+                memory = self.memory()
+                schedule(
+                    "openai",
+                    lambda: memory.add(batch, user_id=user_id, metadata={"source": "backfill", "thread_id": thread_id}),
+                    session=user_id,
+                    priority=BACKGROUND,
+                    tokens=tokens,
+                )
+                self.watermarks.set(thread_id, end)
+            progress.add(batches=1, messages=len(batch), tokens=tokens)
+        progress.add(threads=1)
+
+    def run(self, limit=None):
+        conn = connect_sqlite(self.db_path)
+        progress = Progress(min(count_threads(conn), limit or float("inf")))
+        slots = threading.BoundedSemaphore(self.workers * 2)
+        stop = threading.Event()
+
+        def reporter():
+            while not stop.wait(BACKFILL_REPORT_INTERVAL):
+                progress.report()
+
+        def work(thread_id):
+            try:
+                self.backfill_thread(thread_id, progress)
+            except Exception as e:
+                logger.warning("backfill of %s failed: %s", thread_id, e)
+                progress.add(errors=1)
+            finally:
+                slots.release()
+
+        threading.Thread(target=reporter, daemon=True).start()
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="backfill") as pool:
+                for count, thread_id in enumerate(iter_threads(conn)):
+                    if limit and count >= limit:
+                        break
+                    # Bound the queue so millions of threads never sit in memory at once.
+                    slots.acquire()
+                    pool.submit(work, thread_id)
+        finally:
+            stop.set()
+            conn.close()
+        progress.report(final=True)
+        return progress
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill or rebuild mem0 memories from stored checkpoints")
+    parser.add_argument("--db", default=sqlite_path(CHECKPOINT_URL))
+    parser.add_argument("--collection", required=True,
+                        help="vector store collection to write; use a new name to reindex with another embedder")
+    parser.add_argument("--live", action="store_true",
+                        help=f"allow writing into the live collection ({MEMORY_COLLECTION})")
+    parser.add_argument("--embedding-model", default=MEMORY_EMBEDDING_MODEL)
+    parser.add_argument("--workers", type=int, default=BACKFILL_WORKERS)
+    parser.add_argument("--batch-turns", type=int, default=BACKFILL_BATCH_TURNS)
+    parser.add_argument("--limit", type=int, help="stop after this many threads")
+    parser.add_argument("--reset", action="store_true", help="forget the watermark for this collection and start over")
+    parser.add_argument("--dry-run", action="store_true", help="count the work without calling the memory store")
+    args = parser.parse_args()
+    if args.collection == MEMORY_COLLECTION and not args.live and not args.dry_run:
+        # Live turns never advance the watermark, so every stored turn would be extracted again.
+        parser.error(f"{args.collection} is the live collection: turns the app already stored will be "
+                     "extracted again. Pass --live to fill gaps in it anyway, or backfill a new collection.")
+
+    backfill = Backfill(args.db, args.collection, args.embedding_model, workers=args.workers,
+                        batch_turns=args.batch_turns, dry_run=args.dry_run)
+    if args.reset:
+        backfill.watermarks.reset()
+    backfill.run(args.limit)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+import hashlib
+import os
+import threading
+import httpx
+
+load_dotenv()
+
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "20"))
+HTTP_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_KEEPALIVE_CONNECTIONS", "10"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30"))
+CLIENT_CACHE_SIZE = int(os.getenv("CLIENT_CACHE_SIZE", "32"))
+
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+ELEVENLABS_BASE_URL = os.getenv("ELEVENLABS_BASE_URL", "https://api.elevenlabs.io")
+ELEVENLABS_VOICE_ID = os.getenv("ELEVENLABS_VOICE_ID", "pNInz6obpgDQGcFmaJgB")
+ELEVENLABS_MODEL_ID = os.getenv("ELEVENLABS_MODEL_ID", "eleven_turbo_v2")
+ELEVENLABS_OUTPUT_FORMAT = os.getenv("ELEVENLABS_OUTPUT_FORMAT", "mp3_22050_32")
+
+
+class KeyedCache:
+    def __init__(self, maxsize=CLIENT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, factory):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+        value = factory()
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            self._entries[key] = value
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            return value
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def key_digest(api_key):
+    return hashlib.sha256((api_key or "").encode()).hexdigest()[:16]
+
+def client_key_digest(client):
+    # Clients built by get_elevenlabs_client carry their digest; fall back to the SDK's client wrapper.
+    digest = getattr(client, "key_digest", None)
+    if digest:
+        return digest
+    return key_digest(getattr(getattr(client, "_client_wrapper", None), "api_key", None))
+
+def http2_available():
+    try:
+        import h2
+        return True
+    except ImportError:
+        return False
+
+
+_http_client = None
+_http_lock = threading.Lock()
+
+def get_http_client():
+    global _http_client
+    with _http_lock:
+        if _http_client is None or _http_client.is_closed:
+            _http_client = httpx.Client(
+                http2=http2_available(),
+                limits=httpx.Limits(
+                    max_connections=HTTP_POOL_SIZE,
+                    max_keepalive_connections=HTTP_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+                ),
+                timeout=HTTP_TIMEOUT,
+            )
+        return _http_client
+
+def close_http_client():
+    global _http_client
+    with _http_lock:
+        if _http_client is not None:
+            _http_client.close()
+            _http_client = None
+
+
+_elevenlabs_clients = KeyedCache()
+
+def get_elevenlabs_client(api_key):
+    from elevenlabs.client import ElevenLabs
+
+    def factory():
+        client = ElevenLabs(
+            api_key=api_key,
+            base_url=ELEVENLABS_BASE_URL,
+            httpx_client=get_http_client(),
+        )
+        client.key_digest = key_digest(api_key)
+        return client
+
+    return _elevenlabs_clients.get(key_digest(api_key), factory)
+
+
+_prewarm_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="prewarm")
+
+def _open_connection(url):
+    try:
+        get_http_client().head(url, timeout=5)
+        return True
+    except Exception:
+        return False
+
+def prewarm_connections(urls=None):
+    urls = urls or [OPENAI_BASE_URL, ELEVENLABS_BASE_URL]
+    return [_prewarm_executor.submit(_open_connection, url) for url in urls]
@@ -0,0 +1,104 @@
+import json
+import os
+import re
+import sys
+import time
+
+CRISIS_CLASSIFIER_THRESHOLD = float(os.getenv("CRISIS_CLASSIFIER_THRESHOLD", "0.8"))
+CRISIS_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "crisis_corpus.jsonl")
+
+CRISIS_RESPONSE = (
+    "I'm really glad you told me, and I'm concerned about your safety right now. "
+    "You don't have to go through this alone. Please reach out for immediate support: "
+    "call or text 988 (Suicide & Crisis Lifeline), text HOME to 741741 (Crisis Text Line), "
+    "or call 911 if you are in immediate danger. "
+    "If you can, stay with someone you trust while you reach out. I'm here with you."
+)
+
+CRISIS_PATTERNS = [
+    r"suicid(?:e|al)",
+    r"kill(?:ing)? my ?self",
+    r"end(?:ing)? (?:my (?:own )?life|it all|everything)",
+    r"take my (?:own )?life",
+    r"(?:don'?t|do not|no longer) want to (?:live|be alive|be here|exist|wake up)",
+    r"(?:want to|wanna|going to|plan(?:ning)? to) die",
+    r"wish (?:i|i'?d) (?:was|were|had) (?:never been born|dead)",
+    r"better off (?:dead|without me)",
+    r"no (?:reason|point) (?:to|in) (?:live|living|go(?:ing)? on)",
+    r"can'?t (?:go on|keep going|do this anymore)",
+    r"(?:hurt|harm|cut|cutting|burn|burning|starve|starving) my ?self",
+    r"self[- ]?harm(?:ing)?",
+    r"overdos(?:e|ing)",
+    r"hang(?:ing)? my ?self",
+    r"shoot(?:ing)? my ?self",
+    r"jump(?:ing)? off (?:a |the )?(?:bridge|building|roof)",
+    r"(?:wrote|writing) (?:a |my )?(?:suicide|goodbye) (?:note|letter)",
+]
+
+CRISIS_PATTERN = re.compile(r"\b(?:" + "|".join(CRISIS_PATTERNS) + r")\b", re.IGNORECASE)
+
+_crisis_classifier = None
+
+def register_crisis_classifier(classifier):
+    global _crisis_classifier
+    _crisis_classifier = classifier
+
+def detect_crisis(text):
+    if not text:
+        return False, None
+
+    match = CRISIS_PATTERN.search(text)
+    if match:
+        return True, match.group(0)
+
+    if _crisis_classifier is not None:
+        try:
+            if _crisis_classifier(text) >= CRISIS_CLASSIFIER_THRESHOLD:
+                return True, "classifier"
+        except Exception:
+            pass
+
+    return False, None
+
+
+def load_corpus(path=CRISIS_CORPUS):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def evaluate(corpus):
+    counts = {"tp": 0, "fp": 0, "tn": 0, "fn": 0}
+    misses = []
+    for example in corpus:
+        predicted, _ = detect_crisis(example["text"])
+        expected = bool(example["crisis"])
+        if predicted and expected:
+            counts["tp"] += 1
+        elif predicted:
+            counts["fp"] += 1
+            misses.append(example["text"])
+        elif expected:
+            counts["fn"] += 1
+            misses.append(example["text"])
+        else:
+            counts["tn"] += 1
+
+    precision = counts["tp"] / max(counts["tp"] + counts["fp"], 1)
+    recall = counts["tp"] / max(counts["tp"] + counts["fn"], 1)
+    return precision, recall, counts, misses
+
+def benchmark(corpus, rounds=2000):
+    texts = [example["text"] for example in corpus]
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for text in texts:
+            detect_crisis(text)
+    elapsed = time.perf_counter() - start
+    return elapsed / (rounds * len(texts)) * 1e6
+
+if __name__ == "__main__":
+    corpus = load_corpus(sys.argv[1] if len(sys.argv) > 1 else CRISIS_CORPUS)
+    precision, recall, counts, misses = evaluate(corpus)
+    print(f"Examples: {len(corpus)}  precision: {precision:.2%}  recall: {recall:.2%}  {counts}")
+    for text in misses:
+        print(f"  misclassified: {text}")
+    print(f"Mean detection latency: {benchmark(corpus):.2f} µs/message")
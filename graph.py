@@ -5,21 +5,45 @@ from langgraph.graph.message import add_messages
 from langgraph.checkpoint.sqlite import SqliteSaver
 from langchain.schema import SystemMessage, HumanMessage, AIMessage
 from langchain.chat_models import init_chat_model
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from functools import partial
+import copy
+import logging
 import os
-import sqlite3
+import re
+import threading
 from mem0 import Memory
+from clients import KeyedCache, get_http_client, key_digest
+from crisis import detect_crisis
+from retention import RETENTION_INTERVAL, start_retention_job
+from state_backend import create_checkpointer
+from retrieval import MEMORY_SEARCH_LIMIT, build_memory_context, count_tokens
+from scheduler import INTERACTIVE, BACKGROUND, schedule
+from singleflight import content_key, flight
+from memory_partitions import MEMORY_PARTITIONING, ShardedMemory, check_tenant_index
 
 load_dotenv()
 
-llm = init_chat_model(model="gpt-4o-mini")
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = os.getenv("THERAPY_MODEL", "gpt-4o-mini")
+FAST_MODEL = os.getenv("THERAPY_FAST_MODEL", DEFAULT_MODEL)
+STRONG_MODEL = os.getenv("THERAPY_STRONG_MODEL", "gpt-4o")
+ROUTE_WORD_THRESHOLD = int(os.getenv("ROUTE_WORD_THRESHOLD", "60"))
+ROUTE_CLASSIFIER_THRESHOLD = float(os.getenv("ROUTE_CLASSIFIER_THRESHOLD", "0.5"))
+GRAPH_CACHE_SIZE = int(os.getenv("GRAPH_CACHE_SIZE", "32"))
+COMPLETION_TOKEN_ESTIMATE = int(os.getenv("COMPLETION_TOKEN_ESTIMATE", "500"))
+MEMORY_COLLECTION = os.getenv("MEMORY_COLLECTION", "therapy_memories")
+MEMORY_EMBEDDING_MODEL = os.getenv("MEMORY_EMBEDDING_MODEL")
+MEMORY_WRITE_WORKERS = int(os.getenv("MEMORY_WRITE_WORKERS", "4"))
 
 
 mem0_config = {
     "vector_store": {
         "provider": "qdrant",
         "config": {
-            "collection_name": "therapy_memories",
+            "collection_name": MEMORY_COLLECTION,
             "host": "localhost",
             "port": 6333,
         }
@@ -27,107 +51,66 @@ mem0_config = {
     "llm": {
         "provider": "openai",
         "config": {
-            "model": "gpt-4o-mini",
+            "model": FAST_MODEL,
             "temperature": 0.1
         }
     }
 }
 
 
-try:
-    memory = Memory.from_config(mem0_config)
-except Exception as e:
-    memory = None
-
-
-try:
-    conn = sqlite3.connect("checkpoints.sqlite", check_same_thread=False)
-    checkpointer = SqliteSaver(conn)
-except Exception as e:
-    checkpointer = None
-
-class State(TypedDict):
-    messages: Annotated[list[SystemMessage], add_messages]
-    user_id: str
-
-def retrieve_memories(state: State) -> State:
-    if not memory:
-        return {"messages": [], "user_id": state.get("user_id", "default_user")}
-        
+def build_mem0_config(api_key=None, collection=None, embedding_model=MEMORY_EMBEDDING_MODEL):
+    config = copy.deepcopy(mem0_config)
+    if collection:
+        config["vector_store"]["config"]["collection_name"] = collection
+    embedder = {}
+    if api_key:
+        config["llm"]["config"]["api_key"] = api_key
+        embedder["api_key"] = api_key
+    if embedding_model:
+        embedder["model"] = embedding_model
+    if embedder:
+        config["embedder"] = {"provider": "openai", "config": embedder}
+    return config
+
+def create_llm(api_key=None, model=FAST_MODEL):
+    kwargs = {"api_key": api_key} if api_key else {}
+    return init_chat_model(model=model, http_client=get_http_client(), **kwargs)
+
+def coalesce_embeddings(memory):
+    embedder = memory.embedding_model
+    embed = embedder.embed
+    config = getattr(embedder, "config", None)
+    model = getattr(config, "model", None)
+    credentials = key_digest(getattr(config, "api_key", None) or os.getenv("OPENAI_API_KEY"))
+
+    def coalesced(text, *args, **kwargs):
+        key = content_key("embed", credentials, model, text, args, kwargs)
+        return flight.do(key, lambda: embed(text, *args, **kwargs))
+
+    embedder.embed = coalesced
+    return memory
+
+def open_memory(api_key=None, collection=None, embedding_model=MEMORY_EMBEDDING_MODEL):
+    memory = Memory.from_config(build_mem0_config(api_key, collection, embedding_model))
+    return coalesce_embeddings(check_tenant_index(memory))
+
+def create_memory(api_key=None, collection=None, embedding_model=MEMORY_EMBEDDING_MODEL):
     try:
-        user_id = state.get("user_id", "default_user")
-        
+        if MEMORY_PARTITIONING == "shards":
+            return ShardedMemory(
+                lambda shard: open_memory(api_key, shard, embedding_model),
+                collection or MEMORY_COLLECTION,
+            )
+        return open_memory(api_key, collection, embedding_model)
+    except Exception as e:
+        return None
 
-        last_message = ""
-        for msg in reversed(state["messages"]):
-            if isinstance(msg, HumanMessage):
-                last_message = msg.content
-                break
-        
-        if last_message:
+checkpointer = create_checkpointer()
 
-            relevant_memories = memory.search(query=last_message, user_id=user_id, limit=5)
-            
-
-            memory_list = []
-            
-            if isinstance(relevant_memories, dict):
-
-                if 'results' in relevant_memories:
-                    memory_list = relevant_memories['results']
-                elif 'memories' in relevant_memories:
-                    memory_list = relevant_memories['memories']
-                elif 'data' in relevant_memories:
-                    memory_list = relevant_memories['data']
-                else:
-                    memory_list = [relevant_memories]
-                    
-            elif isinstance(relevant_memories, list):
-                memory_list = relevant_memories
-            else:
-                memory_list = []
-            
-            if memory_list:
-
-                memory_texts = []
-                for mem in memory_list:
-                    if isinstance(mem, dict):
-
-                        memory_text = (
-                            mem.get('memory') or 
-                            mem.get('text') or 
-                            mem.get('content') or 
-                            mem.get('data') or
-                            str(mem)
-                        )
-                    elif isinstance(mem, str):
-                        memory_text = mem
-                    else:
-                        memory_text = str(mem)
-                    
-                    if memory_text and memory_text.strip():
-                        memory_texts.append(memory_text.strip())
-                
-                if memory_texts:
-                    memory_context = "\n".join(memory_texts)
-                    memory_prompt = SystemMessage(content=f"""
-                    Previous conversation memories about this user:
-                    {memory_context}
-                    
-                    Use this context to provide more personalized and contextual responses. 
-                    Remember details about the user's previous sessions, concerns, and progress.
-                    Build upon what you know about this user from previous conversations.
-                    """)
-                    
-                    return {"messages": [memory_prompt], "user_id": user_id}
-    
-    except Exception as e:
-        pass
-    
-    return {"messages": [], "user_id": state.get("user_id", "default_user")}
+if isinstance(checkpointer, SqliteSaver) and RETENTION_INTERVAL > 0:
+    start_retention_job(checkpointer.conn, lock=checkpointer.lock)
 
-def chatbot(state: State) -> State:
-    system_prompt = SystemMessage(content="""You are a compassionate and supportive virtual therapist chatbot, specially designed to help users manage stress, anger, tension, depression, anxiety, and other life-related challenges. Your primary goal is to listen empathetically, guide users towards understanding their feelings and thoughts, and provide actionable strategies and coping mechanisms to improve their mental and emotional well-being.  
+SYSTEM_PROMPT = """You are a compassionate and supportive virtual therapist chatbot, specially designed to help users manage stress, anger, tension, depression, anxiety, and other life-related challenges. Your primary goal is to listen empathetically, guide users towards understanding their feelings and thoughts, and provide actionable strategies and coping mechanisms to improve their mental and emotional well-being.  
 
         When interacting with users, always adhere to these guiding principles:
 
@@ -170,16 +153,159 @@ def chatbot(state: State) -> State:
         * Build upon previous therapeutic work and insights
 
         Always maintain a calming, respectful tone, consistently encouraging users to take proactive, positive steps towards improving their mental health and overall life quality.
-        """)
-    
+        """
+
+SYSTEM_MESSAGE = SystemMessage(content=SYSTEM_PROMPT)
+
+MEMORY_PROMPT_TEMPLATE = """Previous conversation memories about this user:
+{memory_context}
+
+Use this context to provide more personalized and contextual responses.
+Remember details about the user's previous sessions, concerns, and progress.
+Build upon what you know about this user from previous conversations."""
+
+_memory_writer = ThreadPoolExecutor(max_workers=MEMORY_WRITE_WORKERS, thread_name_prefix="memory-write")
+
+prompt_cache_stats = {"turns": 0, "prompt_tokens": 0, "cached_tokens": 0}
+_prompt_cache_lock = threading.Lock()
+
+COMPLEX_TURN_PATTERN = re.compile(
+    r"\b(suicid\w*|kill (?:my|him|her)sel(?:f|ves)|self[- ]?harm\w*|hurt(?:ing)? myself|overdos\w*"
+    r"|abus\w*|assault\w*|rape\w*|trauma\w*|ptsd|panic attacks?|hopeless\w*|worthless\w*"
+    r"|can'?t go on|end it all|griev\w*|grief|relaps\w*|addict\w*|eating disorder|medication)\b",
+    re.IGNORECASE,
+)
+
+routing_stats = {"fast": 0, "strong": 0}
+_routing_lock = threading.Lock()
+_turn_classifier = None
+
+def register_turn_classifier(classifier):
+    global _turn_classifier
+    _turn_classifier = classifier
 
-    messages = [system_prompt] + state["messages"]
-    response = llm.invoke(messages)
+def classify_turn(text, crisis=False):
+    if crisis:
+        return "strong", "crisis"
+    if COMPLEX_TURN_PATTERN.search(text):
+        return "strong", "keyword"
+    if len(text.split()) > ROUTE_WORD_THRESHOLD:
+        return "strong", "length"
+    if _turn_classifier is not None:
+        try:
+            if _turn_classifier(text) >= ROUTE_CLASSIFIER_THRESHOLD:
+                return "strong", "classifier"
+        except Exception as e:
+            logger.warning("turn classifier failed: %s", e)
+    return "fast", "default"
+
+
+class State(TypedDict):
+    messages: Annotated[list[SystemMessage], add_messages]
+    user_id: str
+    crisis: bool
+
+def last_user_message(state: State) -> str:
+    for msg in reversed(state["messages"]):
+        if isinstance(msg, HumanMessage):
+            return msg.content
+    return ""
+
+def detect_crisis_signals(state: State) -> State:
+    crisis, signal = detect_crisis(last_user_message(state))
+    if crisis:
+        logger.warning("crisis signal detected for %s: %r", state.get("user_id", "default_user"), signal)
+    return {"crisis": crisis, "user_id": state.get("user_id", "default_user")}
+
+def retrieve_memories(state: State, memory=None, priority=INTERACTIVE) -> str:
+    # Returns the context rather than a state update so memories never reach a checkpoint.
+    if not memory:
+        return ""
+        
+    try:
+        user_id = state.get("user_id", "default_user")
+        
+
+        last_message = last_user_message(state)
+        
+        if last_message:
+
+            relevant_memories = schedule(
+                "openai",
+                lambda: memory.search(query=last_message, user_id=user_id, limit=MEMORY_SEARCH_LIMIT),
+                session=user_id,
+                priority=priority,
+                tokens=count_tokens(last_message),
+            )
+            return build_memory_context(relevant_memories, user_id=user_id)
+    
+    except Exception as e:
+        pass
+    
+    return ""
+
+def assemble_prompt(state: State, memory_context="") -> list:
+    messages = [SYSTEM_MESSAGE]
+    messages.extend(msg for msg in state["messages"] if not isinstance(msg, SystemMessage))
+
+    if memory_context:
+        messages.append(SystemMessage(content=MEMORY_PROMPT_TEMPLATE.format(memory_context=memory_context)))
+
+    return messages
+
+def record_prompt_cache_usage(response):
+    usage = getattr(response, "usage_metadata", None) or {}
+    prompt_tokens = usage.get("input_tokens", 0)
+    cached_tokens = (usage.get("input_token_details") or {}).get("cache_read", 0)
+
+    with _prompt_cache_lock:
+        prompt_cache_stats["turns"] += 1
+        prompt_cache_stats["prompt_tokens"] += prompt_tokens
+        prompt_cache_stats["cached_tokens"] += cached_tokens
+
+    if prompt_tokens:
+        logger.info("prompt cache: %d/%d input tokens cached (%.0f%%)",
+                    cached_tokens, prompt_tokens, 100 * cached_tokens / prompt_tokens)
+
+def get_prompt_cache_ratio():
+    with _prompt_cache_lock:
+        if not prompt_cache_stats["prompt_tokens"]:
+            return 0.0
+        return prompt_cache_stats["cached_tokens"] / prompt_cache_stats["prompt_tokens"]
+
+def get_routing_stats():
+    with _routing_lock:
+        stats = dict(routing_stats)
+    total = stats["fast"] + stats["strong"]
+    stats["strong_ratio"] = stats["strong"] / total if total else 0.0
+    return stats
+
+def chatbot(state: State, llm=None, strong_llm=None, memory=None, priority=INTERACTIVE, record=True) -> State:
+    route, reason = classify_turn(last_user_message(state), crisis=state.get("crisis", False))
+    if strong_llm is None:
+        route = "fast"
+
+    if record:
+        with _routing_lock:
+            routing_stats[route] += 1
+    logger.info("routing turn for %s to %s model (%s)", state.get("user_id", "default_user"), route, reason)
+
+    model = strong_llm if route == "strong" else llm
+    prompt = assemble_prompt(state, retrieve_memories(state, memory, priority=priority))
+    estimate = sum(count_tokens(str(m.content)) for m in prompt) + COMPLETION_TOKEN_ESTIMATE
+    response = schedule(
+        "openai",
+        lambda: model.invoke(prompt),
+        session=state.get("user_id", "default_user"),
+        priority=priority,
+        tokens=estimate,
+    )
+    record_prompt_cache_usage(response)
     return {"messages": [response], "user_id": state.get("user_id", "default_user")}
 
-def store_memories(state: State) -> State:
+def store_memories(state: State, memory=None) -> State:
     if not memory:
-        return {"messages": [], "user_id": state.get("user_id", "default_user")}
+        return {"user_id": state.get("user_id", "default_user")}
         
     try:
         user_id = state.get("user_id", "default_user")
@@ -195,29 +321,86 @@ def store_memories(state: State) -> State:
                 conversation_text += f"{role}: {msg.content}\n"
         
         if conversation_text:
-
-            memory.add(conversation_text, user_id=user_id)
+            # Handed off so the turn ends with the reply; the write waits in the background queue.
+            _memory_writer.submit(write_memories, memory, conversation_text, user_id)
     
     except Exception as e:
         pass
     
-    return {"messages": [], "user_id": state.get("user_id", "default_user")}
-
-
-graph = StateGraph(State)
-graph.add_node("retrieve_memories", retrieve_memories)
-graph.add_node("chatbot", chatbot)
-graph.add_node("store_memories", store_memories)
-
-
-graph.add_edge(START, "retrieve_memories")
-graph.add_edge("retrieve_memories", "chatbot")
-graph.add_edge("chatbot", "store_memories")
-graph.add_edge("store_memories", END)
-
-
-if checkpointer:
-    app = graph.compile(checkpointer=checkpointer)
-else:
-    app = graph.compile()
+    return {"user_id": state.get("user_id", "default_user")}
 
+def write_memories(memory, conversation_text, user_id):
+    try:
+        schedule(
+            "openai",
+            lambda: memory.add(conversation_text, user_id=user_id),
+            session=user_id,
+            priority=BACKGROUND,
+            tokens=count_tokens(conversation_text),
+        )
+    except Exception as e:
+        logger.warning("storing memories for %s failed: %s", user_id, e)
+
+
+def build_graph(llm, memory=None, checkpointer=None, strong_llm=None):
+    graph = StateGraph(State)
+    graph.add_node("detect_crisis", detect_crisis_signals)
+    graph.add_node("chatbot", partial(chatbot, llm=llm, strong_llm=strong_llm, memory=memory))
+    graph.add_node("store_memories", partial(store_memories, memory=memory))
+
+
+    graph.add_edge(START, "detect_crisis")
+    graph.add_edge("detect_crisis", "chatbot")
+    graph.add_edge("chatbot", "store_memories")
+    graph.add_edge("store_memories", END)
+
+
+    if checkpointer:
+        return graph.compile(checkpointer=checkpointer)
+    return graph.compile()
+
+
+_graph_cache = KeyedCache(GRAPH_CACHE_SIZE)
+_memory_cache = KeyedCache(GRAPH_CACHE_SIZE)
+_model_cache = KeyedCache(GRAPH_CACHE_SIZE)
+
+def get_memory(api_key=None):
+    key = key_digest(api_key)
+    memory = _memory_cache.get(key, lambda: create_memory(api_key))
+    if memory is None:
+        # The store was unreachable; don't pin that, so the next turn tries again.
+        _memory_cache.discard(key)
+    return memory
+
+def get_models(api_key=None):
+    def factory():
+        llm = create_llm(api_key, FAST_MODEL)
+        strong_llm = create_llm(api_key, STRONG_MODEL) if STRONG_MODEL != FAST_MODEL else None
+        return llm, strong_llm
+
+    return _model_cache.get(key_digest(api_key), factory)
+
+def get_therapy_app(api_key=None):
+    key = key_digest(api_key)
+    built = {}
+
+    def factory():
+        llm, strong_llm = get_models(api_key)
+        built["memory"] = get_memory(api_key)
+        return build_graph(llm, built["memory"], checkpointer, strong_llm=strong_llm)
+
+    therapy_app = _graph_cache.get(key, factory)
+    if built and built["memory"] is None:
+        # A graph built without memory serves this turn only; later turns rebuild once the store is back.
+        _graph_cache.discard(key)
+    return therapy_app
+
+def draft_turn(state, api_key=None, priority=BACKGROUND):
+    # Runs the graph's nodes up to the reply without touching the checkpointer or storing memories.
+    llm, strong_llm = get_models(api_key)
+    state = {**state, **detect_crisis_signals(state)}
+    if state["crisis"]:
+        return None
+    memory = get_memory(api_key)
+    # Drafts are not counted as routed turns; most of them are thrown away.
+    return chatbot(state, llm=llm, strong_llm=strong_llm, memory=memory, priority=priority, record=False)["messages"][0]
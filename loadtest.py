@@ -0,0 +1,110 @@
+from dotenv import load_dotenv
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+import httpx
+import websockets
+
+load_dotenv()
+
+PROMPTS = [
+    "I've been feeling stressed about work lately.",
+    "How can I calm down before a big meeting?",
+    "I keep arguing with my partner and I don't know why.",
+    "I can't sleep well these days.",
+]
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+async def http_session(client, url, session, turns, results, headers):
+    session_id = None
+    for turn in range(turns):
+        payload = {"user_id": f"loadtest_{session}", "message": PROMPTS[turn % len(PROMPTS)]}
+        if session_id:
+            payload["session_id"] = session_id
+        start = time.perf_counter()
+        try:
+            response = await client.post(f"{url}/v1/turn", json=payload, headers=headers)
+            body = response.json()
+            session_id = body.get("session_id", session_id)
+            results.append({"total": time.perf_counter() - start, "ok": response.status_code == 200})
+        except Exception:
+            results.append({"total": time.perf_counter() - start, "ok": False})
+
+async def ws_session(url, session, turns, results, headers, tts):
+    ws_url = url.replace("http", "ws", 1) + "/v1/stream"
+    try:
+        async with websockets.connect(ws_url, additional_headers=headers, max_size=None) as ws:
+            await ws.send(json.dumps({"type": "start", "user_id": f"loadtest_{session}"}))
+            await ws.recv()
+            for turn in range(turns):
+                start = time.perf_counter()
+                first_token = first_audio = None
+                await ws.send(json.dumps({"type": "turn", "message": PROMPTS[turn % len(PROMPTS)], "tts": tts}))
+                ok = False
+                while True:
+                    frame = await ws.recv()
+                    if isinstance(frame, bytes):
+                        first_audio = first_audio or time.perf_counter() - start
+                        continue
+                    event = json.loads(frame)
+                    if event["type"] == "token" and first_token is None:
+                        first_token = time.perf_counter() - start
+                    elif event["type"] == "done":
+                        ok = event.get("success", False)
+                        if not tts:
+                            break
+                    elif event["type"] in ("audio_done", "error"):
+                        break
+                results.append({"total": time.perf_counter() - start, "ok": ok,
+                                "first_token": first_token, "first_audio": first_audio})
+    except Exception:
+        results.append({"total": 0.0, "ok": False})
+
+async def run(url, mode, sessions, turns, tts):
+    headers = {}
+    if os.getenv("OPENAI_API_KEY"):
+        headers["Authorization"] = f"Bearer {os.getenv('OPENAI_API_KEY')}"
+    if os.getenv("ELEVENLABS_API_KEY"):
+        headers["X-ElevenLabs-Key"] = os.getenv("ELEVENLABS_API_KEY")
+
+    results = []
+    start = time.perf_counter()
+    if mode == "http":
+        async with httpx.AsyncClient(timeout=120) as client:
+            await asyncio.gather(*(http_session(client, url, s, turns, results, headers) for s in range(sessions)))
+    else:
+        await asyncio.gather(*(ws_session(url, s, turns, results, headers, tts) for s in range(sessions)))
+    elapsed = time.perf_counter() - start
+
+    ok = [r for r in results if r["ok"]]
+    totals = [r["total"] for r in ok]
+    print(f"{mode}: {sessions} sessions x {turns} turns in {elapsed:.1f}s  "
+          f"({len(ok)}/{len(results)} ok, {len(ok) / elapsed:.2f} turns/s)")
+    if totals:
+        print(f"  turn latency  p50 {statistics.median(totals):.2f}s  p95 {percentile(totals, 0.95):.2f}s")
+    for field, label in (("first_token", "first token"), ("first_audio", "first audio")):
+        values = [r[field] for r in ok if r.get(field)]
+        if values:
+            print(f"  {label:<12}  p50 {statistics.median(values):.2f}s  p95 {percentile(values, 0.95):.2f}s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the headless therapy API")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--mode", choices=["http", "ws"], default="ws")
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--tts", action="store_true")
+    args = parser.parse_args()
+    asyncio.run(run(args.url.rstrip("/"), args.mode, args.sessions, args.turns, args.tts))
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,34 @@
 import speech_recognition as sr
-from graph import app as therapy_app
+from graph import get_therapy_app, checkpointer
 import os
 import pygame
-from elevenlabs.client import ElevenLabs
+from clients import KeyedCache, get_elevenlabs_client, prewarm_connections
+from tts import speak_audio
+from state_backend import create_session_id, get_session_store
+from retention import restore_thread
+from langgraph.checkpoint.sqlite import SqliteSaver
+from validation import validate_api_keys
+from crisis import detect_crisis, CRISIS_RESPONSE
 from langchain.schema import HumanMessage, AIMessage
+from transcript import Transcript
+import threading
 import uuid
 
-pygame.mixer.init()
+try:
+    pygame.mixer.init()
+except pygame.error:
+    pass
+
+_playback_lock = threading.Lock()
+
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "20"))
+HISTORY_CACHE_SIZE = int(os.getenv("HISTORY_CACHE_SIZE", "64"))
+
+_history_cache = KeyedCache(HISTORY_CACHE_SIZE)
 
 def initialize_elevenlabs(api_key):
     try:
-        client = ElevenLabs(api_key=api_key)
+        client = get_elevenlabs_client(api_key)
         return client, True, "ElevenLabs initialized successfully"
     except Exception as e:
         return None, False, f"Failed to initialize ElevenLabs: {str(e)}"
@@ -23,34 +41,29 @@ def speak_response(text: str, elevenlabs_client=None, elevenlabs_api_key=None):
             if not success:
                 return False
         
-        if elevenlabs_client is None:
+        if elevenlabs_client is None or not pygame.mixer.get_init():
             return False
         
 
-        audio = elevenlabs_client.text_to_speech.convert(
-            voice_id="pNInz6obpgDQGcFmaJgB",
-            output_format="mp3_22050_32",
-            text=text,
-            model_id="eleven_turbo_v2"
-        )
+        audio, mime = speak_audio(text, elevenlabs_client)
         
 
-        temp_file = f"temp_response_{uuid.uuid4().hex[:8]}.mp3"
+        extension = "wav" if mime == "audio/wav" else "mp3"
+        temp_file = f"temp_response_{uuid.uuid4().hex[:8]}.{extension}"
         with open(temp_file, "wb") as f:
-            for chunk in audio:
-                if chunk:
-                    f.write(chunk)
+            f.write(audio)
         
 
-        pygame.mixer.music.load(temp_file)
-        pygame.mixer.music.play()
-        
+        with _playback_lock:
+            pygame.mixer.music.load(temp_file)
+            pygame.mixer.music.play()
+            
 
-        while pygame.mixer.music.get_busy():
-            pygame.time.wait(100)
-        
+            while pygame.mixer.music.get_busy():
+                pygame.time.wait(100)
+            
 
-        pygame.mixer.music.unload()
+            pygame.mixer.music.unload()
         
 
         try:
@@ -62,6 +75,11 @@ def speak_response(text: str, elevenlabs_client=None, elevenlabs_api_key=None):
     except Exception as e:
         return False
 
+def speak_in_background(text: str, elevenlabs_client=None):
+    thread = threading.Thread(target=speak_response, args=(text, elevenlabs_client), daemon=True)
+    thread.start()
+    return thread
+
 def get_microphone_list():
     try:
         mic_names = sr.Microphone.list_microphone_names()
@@ -115,41 +133,64 @@ def test_api_keys(openai_key, elevenlabs_key):
     errors = []
     
 
-    if openai_key:
-        try:
-            os.environ["OPENAI_API_KEY"] = openai_key
-
-        except Exception as e:
-            errors.append(f"OpenAI key error: {str(e)}")
-    else:
+    if not openai_key:
         errors.append("OpenAI API key is required")
+    if not elevenlabs_key:
+        errors.append("ElevenLabs API key is required")
     
 
-    if elevenlabs_key:
-        try:
-            client, success, message = initialize_elevenlabs(elevenlabs_key)
-            if not success:
-                errors.append(f"ElevenLabs key error: {message}")
-        except Exception as e:
-            errors.append(f"ElevenLabs key error: {str(e)}")
-    else:
-        errors.append("ElevenLabs API key is required")
+    try:
+        results = validate_api_keys(openai_key, elevenlabs_key)
+    except Exception as e:
+        errors.append(f"API key validation error: {str(e)}")
+        results = {}
+    
+
+    for provider, (valid, message) in results.items():
+        if not valid:
+            errors.append(message)
     
     return len(errors) == 0, errors
 
-def get_therapy_response(user_message, conversation_history, user_id, session_id, openai_api_key=None):
+def get_therapy_response(user_message, conversation_history, user_id, session_id, openai_api_key=None, on_crisis=None):
+    crisis, _ = detect_crisis(user_message)
+    crisis_delivered = False
+    conversation_history.add_user(user_message)
+    # Taken before the crisis resources are recorded so the model still replies to the user's turn.
+    messages = conversation_history.to_messages()
+    if crisis and on_crisis:
+        try:
+            on_crisis(CRISIS_RESPONSE)
+            crisis_delivered = True
+        except Exception:
+            pass
+    if crisis_delivered:
+        conversation_history.add_assistant(CRISIS_RESPONSE)
+
+    def crisis_fallback():
+        # The resources go into the transcript once; a None reply means on_crisis already delivered them.
+        if crisis_delivered:
+            return None, True
+        conversation_history.add_assistant(CRISIS_RESPONSE)
+        return CRISIS_RESPONSE, True
+
     try:
 
-        if openai_api_key:
-            os.environ["OPENAI_API_KEY"] = openai_api_key
+        therapy_app = get_therapy_app(openai_api_key)
         
 
-        conversation_history.append(HumanMessage(content=user_message))
+        human_message = HumanMessage(content=user_message)
         
 
         state = {
-            "messages": conversation_history,
-            "user_id": user_id
+            "messages": [human_message] if therapy_app.checkpointer else messages,
+            "user_id": user_id,
+            "crisis": crisis
+        }
+        fallback_state = {
+            "messages": messages,
+            "user_id": user_id,
+            "crisis": crisis
         }
         
 
@@ -167,24 +208,81 @@ def get_therapy_response(user_message, conversation_history, user_id, session_id
         except Exception:
 
             try:
-                for event in therapy_app.stream(state, stream_mode="values"):
+                for event in therapy_app.stream(fallback_state, stream_mode="values"):
                     if "messages" in event and event["messages"]:
                         last_msg = event["messages"][-1]
                         if hasattr(last_msg, 'content'):
                             therapist_response = last_msg.content
             except Exception:
+                if crisis:
+                    return crisis_fallback()
                 therapist_response = "I apologize, but I'm having technical difficulties. Please check your OpenAI API key and try again."
         
         if therapist_response:
 
-            conversation_history.append(AIMessage(content=therapist_response))
+            conversation_history.add_assistant(therapist_response)
             return therapist_response, True
+        elif crisis:
+            return crisis_fallback()
         else:
             return "I apologize, but I'm having technical difficulties. Please check your API key and try again.", False
     
     except Exception as e:
+        if crisis:
+            return crisis_fallback()
         return "I'm experiencing some technical issues. Please check your API keys and try again later.", False
 
+def _thread_messages(session_id):
+    if not checkpointer:
+        return []
+    try:
+        checkpoint = checkpointer.get_tuple({"configurable": {"thread_id": session_id}})
+    except Exception:
+        return []
+    if not checkpoint:
+        return []
+    messages = checkpoint.checkpoint.get("channel_values", {}).get("messages", [])
+    return [msg for msg in messages if isinstance(msg, (HumanMessage, AIMessage))]
+
+def load_conversation_history(session_id, before=None, page_size=None):
+    # Loading the latest page reads the checkpoint once and keeps it as a compact Transcript. Earlier
+    # pages are slices of it, because new turns only append after them.
+    if before is None:
+        _history_cache.discard(session_id)
+    transcript = _history_cache.get(session_id, lambda: Transcript.from_messages(_thread_messages(session_id)))
+    end = len(transcript) if before is None else min(before, len(transcript))
+    start = max(0, end - page_size) if page_size else 0
+    return transcript.slice(start, end), start
+
+def thread_exists(session_id):
+    if not checkpointer:
+        return False
+    config = {"configurable": {"thread_id": session_id}}
+    try:
+        if checkpointer.get_tuple(config):
+            return True
+        if isinstance(checkpointer, SqliteSaver):
+            return restore_thread(checkpointer.conn, session_id, lock=checkpointer.lock)
+    except Exception:
+        pass
+    return False
+
+def resume_or_create_session(user_id):
+    try:
+        session_id = get_session_store().latest_thread(user_id)
+    except Exception:
+        session_id = None
+    
+    if session_id and thread_exists(session_id):
+        return session_id, True
+    return create_session_id(user_id), False
+
+def record_session(user_id, session_id):
+    try:
+        get_session_store().record_thread(user_id, session_id)
+    except Exception:
+        pass
+
 def create_user_profile(user_name):
     user_id = f"{user_name.strip()}_{str(uuid.uuid4())[:8]}"
     return user_id
@@ -201,9 +299,6 @@ def load_user_identity():
             return f.read().strip()
     return None
 
-def create_session_id(user_id):
-    return f"session_{user_id}_{str(uuid.uuid4())[:8]}"
-
 def get_user_identity():
     user_id = load_user_identity()
     
@@ -254,6 +349,7 @@ def console_main():
         return
     
 
+    prewarm_connections()
     elevenlabs_client, tts_ready, tts_message = initialize_elevenlabs(elevenlabs_key)
     if not tts_ready:
         print(f"⚠️ Text-to-speech not available: {tts_message}")
@@ -262,7 +358,10 @@ def console_main():
     user_id = get_user_identity()
     
 
-    session_id = create_session_id(user_id)
+    session_id, resumed = resume_or_create_session(user_id)
+    record_session(user_id, session_id)
+    if resumed:
+        print(f"Resuming your previous session: {session_id}")
     
     print("-" * 50)
     
@@ -276,7 +375,7 @@ def console_main():
         print("OnePlus Buds 3 microphone not found, using default microphone")
 
 
-    conversation_messages = []
+    conversation_messages, _ = load_conversation_history(session_id, page_size=HISTORY_PAGE_SIZE) if resumed else (Transcript(), 0)
     print("Therapist AI with Memory is ready. Say 'quit' or 'exit' to end the session.")
     print("-" * 50)
 
@@ -302,12 +401,18 @@ def console_main():
                 break
 
 
-            response, success = get_therapy_response(text, conversation_messages, user_id, session_id, openai_key)
+            def on_crisis(crisis_text):
+                print(f"Therapist: {crisis_text}")
+                if tts_ready:
+                    speak_in_background(crisis_text, elevenlabs_client)
+
+            response, success = get_therapy_response(text, conversation_messages, user_id, session_id, openai_key, on_crisis=on_crisis)
             
             if success:
-                print(f"Therapist: {response}")
-                if tts_ready:
-                    speak_response(response, elevenlabs_client)
+                if response:
+                    print(f"Therapist: {response}")
+                    if tts_ready:
+                        speak_response(response, elevenlabs_client)
             else:
                 print(f"Error: {response}")
             
@@ -0,0 +1,233 @@
+from dotenv import load_dotenv
+import argparse
+import logging
+import os
+import random
+import statistics
+import threading
+import time
+import warnings
+import zlib
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+MEMORY_PARTITIONING = os.getenv("MEMORY_PARTITIONING", "tenant")
+MEMORY_SHARDS = int(os.getenv("MEMORY_SHARDS", "16"))
+MEMORY_TENANT_HNSW = os.getenv("MEMORY_TENANT_HNSW", "1") == "1"
+TENANT_FIELD = "user_id"
+
+
+def shard_for(user_id, shards=MEMORY_SHARDS):
+    # crc32 rather than hash(): the mapping has to be identical in every process and across restarts.
+    return zlib.crc32(str(user_id or "").encode()) % shards
+
+def shard_collection(collection, index):
+    return f"{collection}_{index:03d}"
+
+def ensure_tenant_index(client, collection, field=TENANT_FIELD, tenant_hnsw=MEMORY_TENANT_HNSW):
+    from qdrant_client import models
+
+    info = client.get_collection(collection)
+    if field in (info.payload_schema or {}):
+        return False
+    client.create_payload_index(
+        collection,
+        field_name=field,
+        field_schema=models.KeywordIndexParams(type=models.KeywordIndexType.KEYWORD, is_tenant=True),
+        wait=True,
+    )
+    if tenant_hnsw:
+        # Every query filters on the tenant, so build per-tenant graphs instead of one global graph.
+        client.update_collection(collection, hnsw_config=models.HnswConfigDiff(payload_m=16, m=0))
+    logger.info("created tenant index on %s.%s", collection, field)
+    return True
+
+def check_tenant_index(memory, field=TENANT_FIELD):
+    # Only reports: creating the index rewrites the HNSW config and rebuilds it under live traffic.
+    store = memory.vector_store
+    name = getattr(store, "collection_name", "?")
+    try:
+        if field not in (store.client.get_collection(name).payload_schema or {}):
+            logger.warning("%s has no tenant index on %s; run `python memory_partitions.py migrate` "
+                           "during a quiet period", name, field)
+    except Exception as e:
+        logger.warning("could not check the tenant index of %s: %s", name, e)
+    return memory
+
+
+class ShardedMemory:
+    """Routes each user's memories to one of a fixed number of collections."""
+
+    def __init__(self, factory, collection, shards=MEMORY_SHARDS):
+        self.factory = factory
+        self.collection = collection
+        self.shards = shards
+        self._memories = {}
+        self._lock = threading.Lock()
+
+    def shard(self, user_id):
+        index = shard_for(user_id, self.shards)
+        with self._lock:
+            if index not in self._memories:
+                self._memories[index] = self.factory(shard_collection(self.collection, index))
+            return self._memories[index]
+
+    @property
+    def vector_store(self):
+        return self.shard(None).vector_store
+
+    def search(self, query, user_id=None, **kwargs):
+        return self.shard(user_id).search(query, user_id=user_id, **kwargs)
+
+    def add(self, messages, user_id=None, **kwargs):
+        return self.shard(user_id).add(messages, user_id=user_id, **kwargs)
+
+    def get_all(self, user_id=None, **kwargs):
+        return self.shard(user_id).get_all(user_id=user_id, **kwargs)
+
+    def delete_all(self, user_id=None, **kwargs):
+        return self.shard(user_id).delete_all(user_id=user_id, **kwargs)
+
+
+def _copy_collection_schema(client, source, target):
+    if not client.collection_exists(target):
+        client.create_collection(target, vectors_config=client.get_collection(source).config.params.vectors)
+    ensure_tenant_index(client, target)
+
+def migrate(client, source, mode=MEMORY_PARTITIONING, shards=MEMORY_SHARDS, target=None, batch_size=256):
+    if mode == "tenant" and not target:
+        # In place: Qdrant builds the index and per-tenant graphs in the background.
+        ensure_tenant_index(client, source)
+        print(f"Indexed {source} by {TENANT_FIELD} ({client.count(source, exact=True).count} points)")
+        return
+
+    from qdrant_client import models
+
+    if mode == "shards":
+        route = lambda payload: shard_collection(target or source, shard_for(payload.get(TENANT_FIELD), shards))
+        targets = [shard_collection(target or source, i) for i in range(shards)]
+    else:
+        route = lambda payload: target
+        targets = [target]
+    for name in targets:
+        _copy_collection_schema(client, source, name)
+
+    total = client.count(source, exact=True).count
+    moved, offset, start = 0, None, time.monotonic()
+    while True:
+        points, offset = client.scroll(source, limit=batch_size, offset=offset, with_payload=True, with_vectors=True)
+        batches = {}
+        for point in points:
+            batches.setdefault(route(point.payload or {}), []).append(
+                models.PointStruct(id=point.id, vector=point.vector, payload=point.payload)
+            )
+        for name, batch in batches.items():
+            client.upsert(name, points=batch)
+        moved += len(points)
+        print(f"\rMigrated {moved}/{total} points ({moved / max(time.monotonic() - start, 1e-9):.0f}/s)",
+              end="", flush=True)
+        if offset is None:
+            break
+    print()
+    print(f"Copied {source} into {len(targets)} collection(s); point MEMORY_COLLECTION/MEMORY_PARTITIONING at "
+          f"the new layout, then drop {source}.")
+
+
+def _bench_layout(client, layout, users, per_user, dim, queries, shards, max_seconds, batch_size=2048):
+    from qdrant_client import models
+    import numpy as np
+
+    base = f"bench_{layout}"
+    names = [shard_collection(base, i) for i in range(shards)] if layout == "shards" else [base]
+    for name in names:
+        if client.collection_exists(name):
+            client.delete_collection(name)
+        client.create_collection(name, vectors_config=models.VectorParams(size=dim, distance=models.Distance.COSINE))
+        if layout != "single":
+            ensure_tenant_index(client, name)
+    route = (lambda user: names[shard_for(user, shards)]) if layout == "shards" else (lambda user: base)
+
+    rng = np.random.default_rng(0)
+    pending, point_id = {}, 0
+    for u in range(users):
+        user = f"user_{u}"
+        for vector in rng.random((per_user, dim), dtype=np.float32):
+            pending.setdefault(route(user), []).append(
+                models.PointStruct(id=point_id, vector=vector.tolist(), payload={TENANT_FIELD: user})
+            )
+            point_id += 1
+        if sum(len(batch) for batch in pending.values()) >= batch_size or u == users - 1:
+            for name, batch in pending.items():
+                client.upsert(name, points=batch, wait=True)
+            pending = {}
+
+    latencies, deadline = [], time.monotonic() + max_seconds
+    for i in range(queries):
+        if i >= 5 and time.monotonic() > deadline:
+            break
+        user = f"user_{random.randrange(users)}"
+        query = rng.random(dim, dtype=np.float32).tolist()
+        start = time.perf_counter()
+        client.query_points(
+            route(user),
+            query=query,
+            query_filter=models.Filter(must=[models.FieldCondition(key=TENANT_FIELD, match=models.MatchValue(value=user))]),
+            limit=10,
+        )
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    for name in names:
+        client.delete_collection(name)
+    latencies.sort()
+    return statistics.median(latencies), latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)]
+
+def benchmark(user_counts=(10, 1000, 100000), per_user=3, dim=64, queries=200, shards=MEMORY_SHARDS, url=None,
+              max_seconds=20.0):
+    from qdrant_client import QdrantClient
+
+    client = QdrantClient(url=url) if url else QdrantClient(":memory:")
+    # Local mode has no payload indexes, so the tenant layout would only repeat the single one.
+    layouts = ("single", "tenant", "shards") if url else ("single", "shards")
+    print(f"Search p50/p95, {per_user} memories/user, dim {dim}, up to {queries} queries or {max_seconds:.0f}s "
+          f"per cell, {'server ' + url if url else 'local in-memory Qdrant'}", flush=True)
+    if not url:
+        print("  local mode scans filters without indexes; use --url to measure the tenant index", flush=True)
+    headers = {"single": "single", "tenant": "tenant index", "shards": f"shards x{shards}"}
+    print(f"  {'users':>8}  " + "  ".join(f"{headers[layout]:>17}" for layout in layouts), flush=True)
+    for users in user_counts:
+        row = []
+        for layout in layouts:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", UserWarning)
+                p50, p95 = _bench_layout(client, layout, users, per_user, dim, queries, shards, max_seconds)
+            row.append(f"{p50:6.2f}/{p95:6.2f} ms")
+        print(f"  {users:>8}  " + "  ".join(f"{cell:>17}" for cell in row), flush=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Tenant-partitioned memory collections")
+    parser.add_argument("command", choices=["migrate", "bench"])
+    parser.add_argument("--url", default=os.getenv("QDRANT_URL"), help="Qdrant server (bench defaults to in-memory)")
+    parser.add_argument("--collection", default=os.getenv("MEMORY_COLLECTION", "therapy_memories"))
+    parser.add_argument("--mode", choices=["tenant", "shards"], default=MEMORY_PARTITIONING)
+    parser.add_argument("--shards", type=int, default=MEMORY_SHARDS)
+    parser.add_argument("--target", help="copy into this collection (or shard prefix) instead of indexing in place")
+    parser.add_argument("--users", default="10,1000,100000")
+    parser.add_argument("--per-user", type=int, default=3)
+    parser.add_argument("--dim", type=int, default=64)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--max-seconds", type=float, default=20.0, help="time budget for the queries of one cell")
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        counts = [int(count) for count in args.users.split(",")]
+        benchmark(counts, args.per_user, args.dim, args.queries, args.shards, args.url, args.max_seconds)
+        return
+
+    from qdrant_client import QdrantClient
+    client = QdrantClient(url=args.url) if args.url else QdrantClient(host="localhost", port=6333)
+    migrate(client, args.collection, args.mode, args.shards, args.target)
+
+if __name__ == "__main__":
+    main()
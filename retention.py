@@ -0,0 +1,289 @@
+from contextlib import nullcontext
+from dotenv import load_dotenv
+import argparse
+import base64
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_DB = os.getenv("CHECKPOINT_DB", "checkpoints.sqlite")
+RETENTION_KEEP_LAST = int(os.getenv("RETENTION_KEEP_LAST", "20"))
+RETENTION_ARCHIVE_AFTER_DAYS = float(os.getenv("RETENTION_ARCHIVE_AFTER_DAYS", "30"))
+RETENTION_INTERVAL = float(os.getenv("RETENTION_INTERVAL", "0"))
+RETENTION_VACUUM_PAGES = int(os.getenv("RETENTION_VACUUM_PAGES", "1000"))
+
+UUID_EPOCH_OFFSET = 0x01B21DD213814000
+
+ARCHIVE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoint_archive (
+    thread_id TEXT PRIMARY KEY,
+    archived_at REAL NOT NULL,
+    row_count INTEGER NOT NULL,
+    data BLOB NOT NULL
+)
+"""
+
+
+def checkpoint_time(checkpoint_id):
+    try:
+        value = uuid.UUID(checkpoint_id)
+    except (ValueError, TypeError):
+        return None
+    if value.version != 6:
+        return None
+    bits = value.int
+    timestamp = ((bits >> 96) << 28) | (((bits >> 80) & 0xFFFF) << 12) | ((bits >> 64) & 0x0FFF)
+    return (timestamp - UUID_EPOCH_OFFSET) / 1e7
+
+def _metadata_source(metadata):
+    try:
+        if isinstance(metadata, bytes):
+            metadata = metadata.decode()
+        return json.loads(metadata).get("source")
+    except Exception:
+        return None
+
+def _has_checkpoint_tables(conn):
+    rows = conn.execute(
+        "SELECT name FROM sqlite_master WHERE type='table' AND name IN ('checkpoints', 'writes')"
+    ).fetchall()
+    return len(rows) == 2
+
+def list_threads(conn):
+    return [row[0] for row in conn.execute("SELECT DISTINCT thread_id FROM checkpoints")]
+
+def _checkpoints_to_drop(rows, keep_last):
+    if not rows:
+        return []
+
+    # A turn starts with an "input" checkpoint; only the last checkpoint of each
+    # turn holds the full post-turn state, everything before it is a node write.
+    turn_final = []
+    for index, (checkpoint_id, metadata) in enumerate(rows):
+        is_last = index == len(rows) - 1
+        if is_last or _metadata_source(rows[index + 1][1]) == "input":
+            turn_final.append(checkpoint_id)
+
+    keep = set(turn_final[-keep_last:]) if keep_last > 0 else {turn_final[-1]}
+    return [checkpoint_id for checkpoint_id, _ in rows if checkpoint_id not in keep]
+
+def prune_thread(conn, thread_id, keep_last=RETENTION_KEEP_LAST):
+    deleted = 0
+    namespaces = [row[0] for row in conn.execute(
+        "SELECT DISTINCT checkpoint_ns FROM checkpoints WHERE thread_id = ?", (thread_id,)
+    )]
+    for checkpoint_ns in namespaces:
+        rows = conn.execute(
+            "SELECT checkpoint_id, metadata FROM checkpoints "
+            "WHERE thread_id = ? AND checkpoint_ns = ? ORDER BY checkpoint_id",
+            (thread_id, checkpoint_ns),
+        ).fetchall()
+        drop = _checkpoints_to_drop(rows, keep_last)
+        conn.executemany(
+            "DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+            [(thread_id, checkpoint_ns, checkpoint_id) for checkpoint_id in drop],
+        )
+        deleted += len(drop)
+
+        if rows:
+            # Pending writes only matter for resuming from the newest checkpoint.
+            conn.execute(
+                "DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id != ?",
+                (thread_id, checkpoint_ns, rows[-1][0]),
+            )
+    return deleted
+
+def prune(conn, keep_last=RETENTION_KEEP_LAST, lock=None):
+    deleted = 0
+    with lock or nullcontext():
+        if not _has_checkpoint_tables(conn):
+            return 0
+        for thread_id in list_threads(conn):
+            deleted += prune_thread(conn, thread_id, keep_last)
+        conn.commit()
+    return deleted
+
+
+def _encode_rows(rows):
+    return [[base64.b64encode(v).decode() if isinstance(v, bytes) else v for v in row] for row in rows]
+
+def _decode_rows(rows, blob_columns):
+    return [
+        tuple(base64.b64decode(v) if i in blob_columns and v is not None else v for i, v in enumerate(row))
+        for row in rows
+    ]
+
+def archive_thread(conn, thread_id):
+    conn.execute(ARCHIVE_SCHEMA)
+    checkpoints = conn.execute(
+        "SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata "
+        "FROM checkpoints WHERE thread_id = ?", (thread_id,)
+    ).fetchall()
+    writes = conn.execute(
+        "SELECT thread_id, checkpoint_ns, checkpoint_id, task_id, idx, channel, type, value "
+        "FROM writes WHERE thread_id = ?", (thread_id,)
+    ).fetchall()
+    if not checkpoints:
+        return False
+
+    payload = json.dumps({"checkpoints": _encode_rows(checkpoints), "writes": _encode_rows(writes)})
+    conn.execute(
+        "INSERT OR REPLACE INTO checkpoint_archive (thread_id, archived_at, row_count, data) VALUES (?, ?, ?, ?)",
+        (thread_id, time.time(), len(checkpoints) + len(writes), zlib.compress(payload.encode(), 9)),
+    )
+    conn.execute("DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,))
+    conn.execute("DELETE FROM writes WHERE thread_id = ?", (thread_id,))
+    return True
+
+def archive_cold_threads(conn, older_than_days=RETENTION_ARCHIVE_AFTER_DAYS, lock=None):
+    cutoff = time.time() - older_than_days * 86400
+    archived = 0
+    with lock or nullcontext():
+        if not _has_checkpoint_tables(conn):
+            return 0
+        latest = conn.execute("SELECT thread_id, MAX(checkpoint_id) FROM checkpoints GROUP BY thread_id").fetchall()
+        for thread_id, checkpoint_id in latest:
+            last_seen = checkpoint_time(checkpoint_id)
+            if last_seen is not None and last_seen < cutoff:
+                archived += archive_thread(conn, thread_id)
+        conn.commit()
+    return archived
+
+def restore_thread(conn, thread_id, lock=None):
+    with lock or nullcontext():
+        conn.execute(ARCHIVE_SCHEMA)
+        row = conn.execute("SELECT data FROM checkpoint_archive WHERE thread_id = ?", (thread_id,)).fetchone()
+        if row is None:
+            return False
+
+        payload = json.loads(zlib.decompress(row[0]))
+        conn.executemany(
+            "INSERT OR REPLACE INTO checkpoints "
+            "(thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            _decode_rows(payload["checkpoints"], {5, 6}),
+        )
+        conn.executemany(
+            "INSERT OR REPLACE INTO writes "
+            "(thread_id, checkpoint_ns, checkpoint_id, task_id, idx, channel, type, value) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            _decode_rows(payload["writes"], {7}),
+        )
+        conn.execute("DELETE FROM checkpoint_archive WHERE thread_id = ?", (thread_id,))
+        conn.commit()
+    return True
+
+
+def vacuum(conn, pages=RETENTION_VACUUM_PAGES, lock=None):
+    with lock or nullcontext():
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            # Switching to incremental mode only takes effect after one full VACUUM.
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.commit()
+            conn.execute("VACUUM")
+        else:
+            conn.execute(f"PRAGMA incremental_vacuum({int(pages)})")
+            conn.commit()
+
+def run_retention(conn, keep_last=RETENTION_KEEP_LAST, archive_after_days=RETENTION_ARCHIVE_AFTER_DAYS,
+                  vacuum_pages=RETENTION_VACUUM_PAGES, lock=None):
+    archived = archive_cold_threads(conn, archive_after_days, lock=lock)
+    pruned = prune(conn, keep_last, lock=lock)
+    vacuum(conn, vacuum_pages, lock=lock)
+    logger.info("checkpoint retention: archived %d threads, pruned %d checkpoints", archived, pruned)
+    return {"archived_threads": archived, "pruned_checkpoints": pruned}
+
+
+def start_retention_job(conn, lock=None, interval=RETENTION_INTERVAL, **kwargs):
+    stop = threading.Event()
+
+    def loop():
+        while not stop.wait(interval):
+            try:
+                run_retention(conn, lock=lock, **kwargs)
+            except Exception as e:
+                logger.warning("checkpoint retention failed: %s", e)
+
+    threading.Thread(target=loop, name="checkpoint-retention", daemon=True).start()
+    return stop
+
+
+def database_size(conn):
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    return page_count * page_size
+
+def read_latency(conn, samples=200):
+    threads = list_threads(conn)
+    if not threads:
+        return 0.0
+    start = time.perf_counter()
+    for i in range(samples):
+        conn.execute(
+            "SELECT checkpoint, metadata FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = '' "
+            "ORDER BY checkpoint_id DESC LIMIT 1", (threads[i % len(threads)],)
+        ).fetchone()
+    return (time.perf_counter() - start) / samples * 1000
+
+def benchmark(path, keep_last=RETENTION_KEEP_LAST, archive_after_days=RETENTION_ARCHIVE_AFTER_DAYS):
+    with tempfile.TemporaryDirectory() as tmp:
+        copy_path = os.path.join(tmp, "checkpoints.sqlite")
+        shutil.copyfile(path, copy_path)
+        conn = sqlite3.connect(copy_path)
+        try:
+            before = (database_size(conn), read_latency(conn))
+            result = run_retention(conn, keep_last, archive_after_days)
+            after = (database_size(conn), read_latency(conn))
+        finally:
+            conn.close()
+
+    print(f"Size:         {before[0] / 1024:.1f} KiB -> {after[0] / 1024:.1f} KiB")
+    print(f"Read latency: {before[1]:.3f} ms -> {after[1]:.3f} ms (latest checkpoint per thread)")
+    print(f"Archived threads: {result['archived_threads']}  Pruned checkpoints: {result['pruned_checkpoints']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Checkpoint retention for checkpoints.sqlite")
+    parser.add_argument("command", choices=["run", "prune", "archive", "restore", "vacuum", "bench"])
+    parser.add_argument("--db", default=CHECKPOINT_DB)
+    parser.add_argument("--keep-last", type=int, default=RETENTION_KEEP_LAST)
+    parser.add_argument("--archive-after-days", type=float, default=RETENTION_ARCHIVE_AFTER_DAYS)
+    parser.add_argument("--vacuum-pages", type=int, default=RETENTION_VACUUM_PAGES)
+    parser.add_argument("--thread-id", help="thread to restore from the archive")
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        benchmark(args.db, args.keep_last, args.archive_after_days)
+        return
+
+    conn = sqlite3.connect(args.db, timeout=30)
+    try:
+        if args.command == "run":
+            print(run_retention(conn, args.keep_last, args.archive_after_days, args.vacuum_pages))
+        elif args.command == "prune":
+            print(f"Pruned {prune(conn, args.keep_last)} checkpoints")
+        elif args.command == "archive":
+            print(f"Archived {archive_cold_threads(conn, args.archive_after_days)} threads")
+        elif args.command == "restore":
+            if not args.thread_id:
+                parser.error("restore requires --thread-id")
+            print("Restored" if restore_thread(conn, args.thread_id) else "No archive for that thread")
+        elif args.command == "vacuum":
+            vacuum(conn, args.vacuum_pages)
+            print(f"Database size: {database_size(conn) / 1024:.1f} KiB")
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
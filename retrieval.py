@@ -0,0 +1,89 @@
+from dotenv import load_dotenv
+import logging
+import os
+import re
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+MEMORY_SEARCH_LIMIT = int(os.getenv("MEMORY_SEARCH_LIMIT", "10"))
+MEMORY_SCORE_THRESHOLD = float(os.getenv("MEMORY_SCORE_THRESHOLD", "0.3"))
+MEMORY_TOKEN_BUDGET = int(os.getenv("MEMORY_TOKEN_BUDGET", "300"))
+MEMORY_MMR_LAMBDA = float(os.getenv("MEMORY_MMR_LAMBDA", "0.7"))
+
+WORD = re.compile(r"\w+")
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("o200k_base")
+
+    def count_tokens(text):
+        return len(_encoding.encode(text))
+except Exception:
+    def count_tokens(text):
+        return max(1, len(text) // 4)
+
+
+def normalize_results(results):
+    if isinstance(results, dict):
+        for key in ("results", "memories", "data"):
+            if key in results:
+                results = results[key]
+                break
+        else:
+            results = [results]
+    if not isinstance(results, list):
+        return []
+
+    hits = []
+    for item in results:
+        if isinstance(item, dict):
+            text = item.get("memory") or item.get("text") or item.get("content") or item.get("data") or ""
+            score = item.get("score")
+        else:
+            text, score = item, None
+        text = str(text).strip()
+        if text:
+            hits.append({"text": text, "score": 1.0 if score is None else float(score)})
+    return hits
+
+def _similarity(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+def select_memories(hits, threshold=MEMORY_SCORE_THRESHOLD, token_budget=MEMORY_TOKEN_BUDGET,
+                    mmr_lambda=MEMORY_MMR_LAMBDA):
+    seen = set()
+    candidates = []
+    for hit in sorted(hits, key=lambda h: h["score"], reverse=True):
+        key = " ".join(WORD.findall(hit["text"].lower()))
+        if hit["score"] < threshold or key in seen:
+            continue
+        seen.add(key)
+        candidates.append((hit, set(key.split())))
+
+    selected, selected_words, used = [], [], 0
+    while candidates:
+        # Maximal marginal relevance: trade relevance against overlap with what is already picked.
+        best = max(
+            range(len(candidates)),
+            key=lambda i: mmr_lambda * candidates[i][0]["score"]
+            - (1 - mmr_lambda) * max((_similarity(candidates[i][1], w) for w in selected_words), default=0.0),
+        )
+        hit, words = candidates.pop(best)
+        tokens = count_tokens(hit["text"]) + 1
+        if used + tokens > token_budget:
+            continue
+        selected.append(hit["text"])
+        selected_words.append(words)
+        used += tokens
+
+    return selected, used
+
+def build_memory_context(results, user_id=None, **kwargs):
+    hits = normalize_results(results)
+    selected, tokens = select_memories(hits, **kwargs)
+    logger.info("memory injection for %s: %d/%d hits, %d tokens", user_id, len(selected), len(hits), tokens)
+    return "\n".join(selected)
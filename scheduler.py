@@ -0,0 +1,258 @@
+from collections import OrderedDict, deque
+from dotenv import load_dotenv
+import argparse
+import logging
+import os
+import random
+import statistics
+import threading
+import time
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+RATE_LIMIT_RETRIES = int(os.getenv("RATE_LIMIT_RETRIES", "3"))
+RATE_LIMIT_BACKOFF = float(os.getenv("RATE_LIMIT_BACKOFF", "1.0"))
+
+PROVIDER_LIMITS = {
+    "openai": {
+        "requests_per_minute": float(os.getenv("OPENAI_RPM", "500")),
+        "tokens_per_minute": float(os.getenv("OPENAI_TPM", "200000")),
+        "max_concurrency": int(os.getenv("OPENAI_MAX_CONCURRENCY", "16")),
+    },
+    "elevenlabs": {
+        "requests_per_minute": float(os.getenv("ELEVENLABS_RPM", "120")),
+        "tokens_per_minute": float(os.getenv("ELEVENLABS_CHARS_PER_MINUTE", "100000")),
+        "max_concurrency": int(os.getenv("ELEVENLABS_MAX_CONCURRENCY", "4")),
+    },
+}
+
+
+class TokenBucket:
+    def __init__(self, per_minute, burst_seconds=60.0):
+        self.rate = per_minute / 60.0
+        self.capacity = self.rate * burst_seconds
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def consume(self, amount):
+        self.level -= min(amount, self.capacity)
+
+    def drain(self):
+        self.level = min(self.level, 0.0)
+
+
+def is_rate_limited(error):
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    return status == 429 or type(error).__name__ == "RateLimitError"
+
+
+class ProviderScheduler:
+    def __init__(self, name, requests_per_minute, tokens_per_minute, max_concurrency, burst_seconds=60.0):
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute, burst_seconds)
+        self.tokens = TokenBucket(tokens_per_minute, burst_seconds)
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self._queues = {INTERACTIVE: OrderedDict(), BACKGROUND: OrderedDict()}
+        self._cond = threading.Condition()
+        self._stats = {"completed": 0, "rate_limited": 0, "wait_total": 0.0}
+
+    def _head(self):
+        for priority in (INTERACTIVE, BACKGROUND):
+            sessions = self._queues[priority]
+            if sessions:
+                session, tickets = next(iter(sessions.items()))
+                return priority, session, tickets[0]
+        return None
+
+    def _dequeue(self, priority, session):
+        sessions = self._queues[priority]
+        tickets = sessions[session]
+        tickets.popleft()
+        # Round-robin: the session goes to the back of its class once it has been served.
+        del sessions[session]
+        if tickets:
+            sessions[session] = tickets
+
+    def _acquire(self, session, priority, tokens):
+        ticket = object()
+        with self._cond:
+            self._queues[priority].setdefault(session, deque()).append(ticket)
+            while True:
+                head = self._head()
+                if head and head[2] is ticket and self.in_flight < self.max_concurrency:
+                    now = time.monotonic()
+                    delay = max(self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+                    if delay == 0:
+                        self._dequeue(priority, session)
+                        self.requests.consume(1)
+                        self.tokens.consume(tokens)
+                        self.in_flight += 1
+                        self._cond.notify_all()
+                        return
+                    self._cond.wait(delay)
+                else:
+                    self._cond.wait()
+
+    def _release(self, rate_limited=False):
+        with self._cond:
+            self.in_flight -= 1
+            if rate_limited:
+                self._stats["rate_limited"] += 1
+                self.requests.drain()
+            else:
+                self._stats["completed"] += 1
+            self._cond.notify_all()
+
+    def run(self, fn, session="default", priority=INTERACTIVE, tokens=1):
+        for attempt in range(RATE_LIMIT_RETRIES + 1):
+            queued = time.monotonic()
+            self._acquire(session, priority, tokens)
+            with self._cond:
+                self._stats["wait_total"] += time.monotonic() - queued
+            try:
+                result = fn()
+            except Exception as e:
+                limited = is_rate_limited(e)
+                self._release(rate_limited=limited)
+                if not limited or attempt == RATE_LIMIT_RETRIES:
+                    raise
+                logger.warning("%s rate limited (%s), retrying %s call", self.name, e, PRIORITY_NAMES[priority])
+                time.sleep(RATE_LIMIT_BACKOFF * (2 ** attempt))
+                continue
+            self._release()
+            return result
+
+    def metrics(self):
+        with self._cond:
+            finished = self._stats["completed"] + self._stats["rate_limited"]
+            return {
+                "queued": {
+                    PRIORITY_NAMES[p]: sum(len(t) for t in q.values()) for p, q in self._queues.items()
+                },
+                "queued_sessions": sum(len(q) for q in self._queues.values()),
+                "in_flight": self.in_flight,
+                "completed": self._stats["completed"],
+                "rate_limited": self._stats["rate_limited"],
+                "mean_wait_seconds": self._stats["wait_total"] / finished if finished else 0.0,
+            }
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+def get_scheduler(provider):
+    with _schedulers_lock:
+        if provider not in _schedulers:
+            _schedulers[provider] = ProviderScheduler(provider, **PROVIDER_LIMITS[provider])
+        return _schedulers[provider]
+
+def schedule(provider, fn, session="default", priority=INTERACTIVE, tokens=1):
+    return get_scheduler(provider).run(fn, session=session, priority=priority, tokens=tokens)
+
+def get_scheduler_metrics():
+    with _schedulers_lock:
+        schedulers = list(_schedulers.values())
+    return {scheduler.name: scheduler.metrics() for scheduler in schedulers}
+
+
+class SimulatedRateLimit(Exception):
+    status_code = 429
+
+class SimulatedProvider:
+    def __init__(self, requests_per_second, latency=0.05):
+        self.window = deque()
+        self.limit = requests_per_second
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.rejected = 0
+
+    def call(self):
+        with self.lock:
+            now = time.monotonic()
+            while self.window and now - self.window[0] > 1.0:
+                self.window.popleft()
+            if len(self.window) >= self.limit:
+                self.rejected += 1
+                raise SimulatedRateLimit("429 Too Many Requests")
+            self.window.append(now)
+        time.sleep(self.latency * random.uniform(0.5, 1.5))
+        return True
+
+def simulate(sessions=20, calls_per_session=10, provider_rps=20, use_scheduler=True):
+    # One simulated second stands in for a provider minute.
+    provider = SimulatedProvider(provider_rps)
+    scheduler = ProviderScheduler("simulated", provider_rps * 0.9 * 60, 1e9, 8, burst_seconds=1.0)
+    latencies = {INTERACTIVE: [], BACKGROUND: []}
+    failures = [0]
+    lock = threading.Lock()
+    monitor_stop = threading.Event()
+    depth_samples = []
+
+    def worker(session):
+        for i in range(calls_per_session):
+            priority = BACKGROUND if i % 2 else INTERACTIVE
+            start = time.monotonic()
+            try:
+                if use_scheduler:
+                    scheduler.run(provider.call, session=session, priority=priority)
+                else:
+                    provider.call()
+            except SimulatedRateLimit:
+                with lock:
+                    failures[0] += 1
+                continue
+            with lock:
+                latencies[priority].append(time.monotonic() - start)
+
+    def monitor():
+        while not monitor_stop.wait(0.1):
+            depth_samples.append(sum(scheduler.metrics()["queued"].values()))
+
+    threading.Thread(target=monitor, daemon=True).start()
+    threads = [threading.Thread(target=worker, args=(f"s{s}",)) for s in range(sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    monitor_stop.set()
+
+    label = "scheduled" if use_scheduler else "unscheduled"
+    print(f"{label}: {failures[0]} failed calls, {provider.rejected} upstream 429s")
+    for priority, values in latencies.items():
+        if values:
+            print(f"  {PRIORITY_NAMES[priority]:<11} n={len(values):<4} p50 {statistics.median(values):.2f}s  "
+                  f"max {max(values):.2f}s")
+    if use_scheduler and depth_samples:
+        print(f"  queue depth  mean {statistics.mean(depth_samples):.1f}  max {max(depth_samples)}")
+    return {"failures": failures[0], "rejected": provider.rejected, "latencies": latencies}
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate provider rate limits with and without the scheduler")
+    parser.add_argument("command", choices=["simulate"])
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--calls", type=int, default=10)
+    parser.add_argument("--provider-rps", type=int, default=20)
+    args = parser.parse_args()
+    for use_scheduler in (False, True):
+        simulate(args.sessions, args.calls, args.provider_rps, use_scheduler)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,371 @@
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from functools import partial
+from langchain.schema import HumanMessage, AIMessage
+import asyncio
+import json
+import logging
+import os
+import re
+import tornado.web
+import tornado.websocket
+from graph import get_therapy_app, get_memory, get_prompt_cache_ratio, get_routing_stats, checkpointer
+from clients import get_elevenlabs_client
+from audio import transcribe_audio, audio_mime_type
+from crisis import detect_crisis, CRISIS_RESPONSE
+from scheduler import get_scheduler_metrics
+from singleflight import singleflight_stats
+from speculation import Speculator, get_speculation_metrics
+from tts import speak_stream, get_tts_metrics
+from state_backend import create_session_id, get_session_store
+from validation import validate_key
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+SERVER_HOST = os.getenv("SERVER_HOST", "0.0.0.0")
+SERVER_PORT = int(os.getenv("SERVER_PORT", "8000"))
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+MAX_AUDIO_BYTES = int(os.getenv("MAX_AUDIO_BYTES", str(10 * 1024 * 1024)))
+SERVER_TURN_WORKERS = int(os.getenv("SERVER_TURN_WORKERS", "32"))
+
+FALLBACK_RESPONSE = "I apologize, but I'm having technical difficulties. Please check your OpenAI API key and try again."
+MISSING_KEY = "send your OpenAI API key as a bearer token"
+
+# The checkpointers are synchronous (SqliteSaver/PostgresSaver have no async methods), so turns run
+# the sync graph API on worker threads instead of ainvoke/astream.
+_turn_executor = ThreadPoolExecutor(max_workers=SERVER_TURN_WORKERS, thread_name_prefix="turn")
+
+
+def _bearer(value):
+    if value and value.lower().startswith("bearer "):
+        return value[7:].strip()
+    return value or None
+
+def claim_session(user_id, session_id=None):
+    # Only threads recorded for this user can be resumed; anything else gets None and is refused.
+    store = get_session_store()
+    if session_id:
+        if not store.owns_thread(user_id, session_id):
+            return None
+    else:
+        session_id = create_session_id(user_id)
+    store.record_thread(user_id, session_id)
+    return session_id
+
+def turn_input(message, user_id, crisis):
+    return {
+        "messages": [HumanMessage(content=message)],
+        "user_id": user_id,
+        "crisis": crisis,
+    }
+
+async def run_turn(message, user_id, session_id, openai_api_key=None):
+    crisis, _ = detect_crisis(message)
+    config = {"configurable": {"thread_id": session_id}}
+    try:
+        therapy_app = get_therapy_app(openai_api_key)
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(
+            _turn_executor, partial(therapy_app.invoke, turn_input(message, user_id, crisis), config=config)
+        )
+        last = result["messages"][-1]
+        if isinstance(last, AIMessage):
+            return last.content, crisis, True
+    except Exception as e:
+        logger.warning("turn failed for %s: %s", session_id, e)
+    return (CRISIS_RESPONSE, crisis, True) if crisis else (FALLBACK_RESPONSE, crisis, False)
+
+async def stream_turn(message, user_id, session_id, openai_api_key=None):
+    crisis, _ = detect_crisis(message)
+    therapy_app = get_therapy_app(openai_api_key)
+    config = {"configurable": {"thread_id": session_id}}
+    loop = asyncio.get_running_loop()
+    tokens = asyncio.Queue()
+    finished = object()
+
+    def produce():
+        # The whole run stays on one worker thread; tokens are handed back to the event loop.
+        try:
+            for chunk, metadata in therapy_app.stream(
+                turn_input(message, user_id, crisis), config=config, stream_mode="messages"
+            ):
+                if metadata.get("langgraph_node") == "chatbot" and chunk.content:
+                    loop.call_soon_threadsafe(tokens.put_nowait, chunk.content)
+        except Exception as e:
+            loop.call_soon_threadsafe(tokens.put_nowait, e)
+        finally:
+            loop.call_soon_threadsafe(tokens.put_nowait, finished)
+
+    run = loop.run_in_executor(_turn_executor, produce)
+    while True:
+        token = await tokens.get()
+        if token is finished:
+            break
+        if isinstance(token, Exception):
+            raise token
+        yield token
+    await run
+
+
+async def check_health(openai_api_key=None):
+    loop = asyncio.get_running_loop()
+    checks = {}
+
+    # The deployment's own keys are never spent on behalf of callers, so these checks need the caller's key.
+    key = openai_api_key
+    if key:
+        valid, message = await loop.run_in_executor(None, validate_key, "openai", key)
+        checks["llm"] = {"ok": valid, "detail": message}
+
+    def check_memory():
+        memory = get_memory(key)
+        if memory is None:
+            return False, "memory store unavailable"
+        client = getattr(memory.vector_store, "client", None)
+        if client is not None:
+            client.get_collections()
+        return True, "ok"
+
+    def check_checkpointer():
+        if checkpointer is None:
+            return False, "checkpointer unavailable"
+        checkpointer.get_tuple({"configurable": {"thread_id": "__health__"}})
+        return True, "ok"
+
+    for name, check in (("memory", check_memory), ("checkpointer", check_checkpointer)):
+        if name == "memory" and not key:
+            continue
+        try:
+            ok, detail = await loop.run_in_executor(None, check)
+        except Exception as e:
+            ok, detail = False, str(e)
+        checks[name] = {"ok": ok, "detail": detail}
+
+    return all(check["ok"] for check in checks.values()), checks
+
+
+class JSONHandler(tornado.web.RequestHandler):
+    def write_json(self, payload, status=200):
+        self.set_status(status)
+        self.set_header("Content-Type", "application/json")
+        self.finish(json.dumps(payload))
+
+    def openai_key(self):
+        return _bearer(self.request.headers.get("Authorization"))
+
+
+class HealthHandler(JSONHandler):
+    async def get(self):
+        healthy, checks = await check_health(self.openai_key())
+        self.write_json({"status": "ok" if healthy else "degraded", "checks": checks}, 200 if healthy else 503)
+
+
+class MetricsHandler(JSONHandler):
+    def get(self):
+        self.write_json({
+            "scheduler": get_scheduler_metrics(),
+            "singleflight": singleflight_stats(),
+            "speculation": get_speculation_metrics(),
+            "tts": get_tts_metrics(),
+            "prompt_cache_ratio": get_prompt_cache_ratio(),
+            "routing": get_routing_stats(),
+        })
+
+
+class TurnHandler(JSONHandler):
+    async def post(self):
+        try:
+            body = json.loads(self.request.body or b"{}")
+        except ValueError:
+            return self.write_json({"error": "invalid JSON body"}, 400)
+
+        message = (body.get("message") or "").strip()
+        user_id = (body.get("user_id") or "").strip()
+        if not message or not user_id:
+            return self.write_json({"error": "message and user_id are required"}, 400)
+
+        openai_api_key = self.openai_key()
+        if not openai_api_key:
+            return self.write_json({"error": MISSING_KEY}, 401)
+
+        loop = asyncio.get_running_loop()
+        session_id = await loop.run_in_executor(None, claim_session, user_id, body.get("session_id"))
+        if session_id is None:
+            return self.write_json({"error": "session_id does not belong to user_id"}, 403)
+        response, crisis, success = await run_turn(message, user_id, session_id, openai_api_key)
+        self.write_json(
+            {"response": response, "session_id": session_id, "crisis": crisis, "success": success},
+            200 if success else 502,
+        )
+
+
+class TurnSocket(tornado.websocket.WebSocketHandler):
+    def open(self):
+        self.openai_api_key = _bearer(self.request.headers.get("Authorization"))
+        self.elevenlabs_api_key = self.request.headers.get("X-ElevenLabs-Key")
+        self.user_id = None
+        self.session_id = None
+        self.speculator = None
+        self.audio_format = audio_mime_type()
+        self.audio_buffer = bytearray()
+
+    def on_close(self):
+        if self.speculator:
+            self.speculator.cancel()
+
+    def send(self, payload):
+        return self.write_message(json.dumps(payload))
+
+    async def on_message(self, message):
+        if isinstance(message, bytes):
+            if len(self.audio_buffer) + len(message) > MAX_AUDIO_BYTES:
+                self.audio_buffer.clear()
+                return await self.send({"type": "error", "error": "audio message too large"})
+            self.audio_buffer.extend(message)
+            return
+
+        try:
+            request = json.loads(message)
+        except ValueError:
+            return await self.send({"type": "error", "error": "invalid JSON"})
+
+        if request.get("type") == "start":
+            user_id = (request.get("user_id") or "").strip()
+            self.openai_api_key = request.get("openai_api_key") or self.openai_api_key
+            self.elevenlabs_api_key = request.get("elevenlabs_api_key") or self.elevenlabs_api_key
+            if not user_id:
+                return await self.send({"type": "error", "error": "user_id is required"})
+            if not self.openai_api_key:
+                return await self.send({"type": "error", "error": MISSING_KEY})
+            loop = asyncio.get_running_loop()
+            session_id = await loop.run_in_executor(None, claim_session, user_id, request.get("session_id"))
+            if session_id is None:
+                return await self.send({"type": "error", "error": "session_id does not belong to user_id"})
+            if self.speculator:
+                self.speculator.cancel()
+            self.user_id, self.session_id = user_id, session_id
+            if Speculator.available():
+                self.speculator = Speculator(self.user_id, self.session_id, self.openai_api_key)
+            return await self.send({
+                "type": "session",
+                "session_id": self.session_id,
+                "audio_format": audio_mime_type(),
+            })
+
+        if request.get("type") == "partial":
+            if self.speculator:
+                self.speculator.partial(request.get("text", ""), stable=request.get("stable", False))
+            return
+
+        if request.get("type") == "audio_end":
+            audio, self.audio_buffer = bytes(self.audio_buffer), bytearray()
+            if not self.user_id:
+                return await self.send({"type": "error", "error": "send a start message first"})
+            loop = asyncio.get_running_loop()
+            text, success, error = await loop.run_in_executor(None, transcribe_audio, audio)
+            await self.send({"type": "transcript", "text": text, "success": success, "error": None if success else error})
+            if success:
+                await self.handle_turn(text, request.get("tts", True))
+            return
+
+        if request.get("type") == "turn":
+            if not self.user_id:
+                return await self.send({"type": "error", "error": "send a start message first"})
+            await self.handle_turn(request.get("message", "").strip(), request.get("tts", False))
+
+    async def handle_turn(self, message, tts):
+        if not message:
+            return await self.send({"type": "error", "error": "empty message"})
+
+        sentences = asyncio.Queue()
+        speaker = asyncio.ensure_future(self.speak(sentences)) if tts and self.elevenlabs_api_key else None
+
+        crisis, _ = detect_crisis(message)
+        if crisis:
+            await self.send({"type": "crisis", "text": CRISIS_RESPONSE})
+            await sentences.put(CRISIS_RESPONSE)
+
+        text, pending = "", ""
+        try:
+            async for token in self.turn_tokens(message):
+                text += token
+                pending += token
+                await self.send({"type": "token", "text": token})
+                *complete, pending = SENTENCE_END.split(pending)
+                for sentence in complete:
+                    await sentences.put(sentence)
+        except Exception as e:
+            logger.warning("streamed turn failed for %s: %s", self.session_id, e)
+
+        if pending.strip():
+            await sentences.put(pending)
+        await sentences.put(None)
+
+        success = bool(text)
+        if not success:
+            text = CRISIS_RESPONSE if crisis else FALLBACK_RESPONSE
+        await self.send({"type": "done", "response": text, "success": success, "crisis": crisis})
+        if speaker:
+            await speaker
+            await self.send({"type": "audio_done"})
+
+    async def turn_tokens(self, message):
+        if self.speculator:
+            loop = asyncio.get_running_loop()
+            drafted = await loop.run_in_executor(None, self.speculator.finalize, message)
+            if drafted:
+                yield drafted
+                return
+        async for token in stream_turn(message, self.user_id, self.session_id, self.openai_api_key):
+            yield token
+
+    async def speak(self, sentences):
+        loop = asyncio.get_running_loop()
+        try:
+            client = get_elevenlabs_client(self.elevenlabs_api_key)
+        except Exception as e:
+            logger.warning("TTS unavailable: %s", e)
+            client = None
+
+        while True:
+            sentence = await sentences.get()
+            if sentence is None:
+                return
+            if client is None:
+                continue
+            try:
+                mime, chunks = await loop.run_in_executor(None, speak_stream, sentence, client, self.user_id)
+                if mime != self.audio_format:
+                    self.audio_format = mime
+                    await self.send({"type": "audio_format", "format": mime})
+                iterator = iter(chunks)
+                while True:
+                    chunk = await loop.run_in_executor(None, next, iterator, None)
+                    if chunk is None:
+                        break
+                    if chunk:
+                        await self.write_message(chunk, binary=True)
+            except tornado.websocket.WebSocketClosedError:
+                return
+            except Exception as e:
+                logger.warning("TTS failed: %s", e)
+
+
+def make_app():
+    return tornado.web.Application([
+        (r"/health", HealthHandler),
+        (r"/metrics", MetricsHandler),
+        (r"/v1/turn", TurnHandler),
+        (r"/v1/stream", TurnSocket),
+    ])
+
+async def serve(host=SERVER_HOST, port=SERVER_PORT):
+    make_app().listen(port, address=host)
+    logger.info("therapy API listening on %s:%d", host, port)
+    await asyncio.Event().wait()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(serve())
@@ -0,0 +1,177 @@
+import hashlib
+import threading
+
+
+def content_key(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _Stream:
+    __slots__ = ("open", "upstream", "chunks", "error", "done", "readers", "lock")
+
+    def __init__(self, open_upstream):
+        self.open = open_upstream
+        self.upstream = None
+        self.chunks = []
+        self.error = None
+        self.done = False
+        self.readers = 0
+        self.lock = threading.Lock()
+
+
+class _Reader:
+    """One caller's view of a shared stream.
+
+    A bare generator skips its finally block when it is closed before the first next(), which
+    would leave the reader counted forever; this releases the slot in that case too.
+    """
+
+    __slots__ = ("_chunks", "_release", "_started", "_closed")
+
+    def __init__(self, chunks, release):
+        self._chunks = chunks
+        self._release = release
+        self._started = False
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        self._started = True
+        return next(self._chunks)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._chunks.close()
+        if not self._started:
+            self._release()
+
+    def __del__(self):
+        self.close()
+
+
+class SingleFlight:
+    """Let concurrent callers with the same key share one upstream call.
+
+    Only requests that overlap in time are merged; once a call finishes its key is
+    forgotten, so this is not a cache.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._streams = {}
+        self._lock = threading.Lock()
+        self._stats = {"upstream": 0, "coalesced": 0}
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._stats["upstream"] += 1
+            else:
+                self._stats["coalesced"] += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stream(self, key, open_upstream):
+        with self._lock:
+            shared = self._streams.get(key)
+            if shared is None:
+                shared = self._streams[key] = _Stream(open_upstream)
+                self._stats["upstream"] += 1
+            else:
+                self._stats["coalesced"] += 1
+            shared.readers += 1
+        return _Reader(self._read(key, shared), lambda: self._release(key, shared))
+
+    def _finish(self, key, shared):
+        with self._lock:
+            if self._streams.get(key) is shared:
+                del self._streams[key]
+
+    def _read(self, key, shared):
+        index = 0
+        try:
+            while True:
+                if index < len(shared.chunks):
+                    yield shared.chunks[index]
+                    index += 1
+                    continue
+                # Whichever reader runs out of buffered chunks pulls the next one, so an
+                # abandoned reader never stalls the others.
+                with shared.lock:
+                    if index < len(shared.chunks):
+                        continue
+                    if shared.error is not None:
+                        raise shared.error
+                    if shared.done:
+                        return
+                    try:
+                        if shared.upstream is None:
+                            shared.upstream = iter(shared.open())
+                        chunk = next(shared.upstream, None)
+                    except Exception as e:
+                        shared.error = e
+                        self._finish(key, shared)
+                        raise
+                    if chunk is None:
+                        shared.done = True
+                        self._finish(key, shared)
+                        return
+                    shared.chunks.append(chunk)
+        finally:
+            self._release(key, shared)
+
+    def _release(self, key, shared):
+        with self._lock:
+            shared.readers -= 1
+            abandoned = shared.readers == 0 and not shared.done and shared.error is None
+            if abandoned and self._streams.get(key) is shared:
+                del self._streams[key]
+        if abandoned:
+            close = getattr(shared.upstream, "close", None)
+            if close:
+                close()
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, "in_flight": len(self._calls) + len(self._streams)}
+
+
+flight = SingleFlight()
+
+def singleflight_stats():
+    return flight.stats()
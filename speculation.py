@@ -0,0 +1,171 @@
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from difflib import SequenceMatcher
+from langchain.schema import HumanMessage
+import logging
+import os
+import re
+import threading
+from crisis import detect_crisis
+from graph import draft_turn, get_memory, get_therapy_app, store_memories, checkpointer
+from retrieval import count_tokens
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+SPECULATION_ENABLED = os.getenv("SPECULATION_ENABLED", "1") == "1"
+SPECULATION_STABLE_PARTIALS = int(os.getenv("SPECULATION_STABLE_PARTIALS", "2"))
+SPECULATION_MIN_WORDS = int(os.getenv("SPECULATION_MIN_WORDS", "3"))
+SPECULATION_MATCH_THRESHOLD = float(os.getenv("SPECULATION_MATCH_THRESHOLD", "0.9"))
+SPECULATION_WORKERS = int(os.getenv("SPECULATION_WORKERS", "8"))
+
+WORD = re.compile(r"\w+")
+
+_executor = ThreadPoolExecutor(max_workers=SPECULATION_WORKERS, thread_name_prefix="speculation")
+_stats_lock = threading.Lock()
+speculation_stats = {"started": 0, "hits": 0, "misses": 0, "used_tokens": 0, "wasted_tokens": 0}
+
+
+def normalize(text):
+    return WORD.findall((text or "").lower())
+
+def transcript_similarity(a, b):
+    a, b = normalize(a), normalize(b)
+    if not a and not b:
+        return 1.0
+    return SequenceMatcher(None, a, b).ratio()
+
+def response_tokens(response):
+    usage = getattr(response, "usage_metadata", None) or {}
+    return usage.get("total_tokens") or count_tokens(str(response.content))
+
+def _record(key, amount=1):
+    with _stats_lock:
+        speculation_stats[key] += amount
+
+def get_speculation_metrics():
+    with _stats_lock:
+        stats = dict(speculation_stats)
+    decided = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = stats["hits"] / decided if decided else 0.0
+    return stats
+
+
+class Draft:
+    __slots__ = ("text", "future")
+
+    def __init__(self, text, future):
+        self.text = text
+        self.future = future
+
+    def discard(self):
+        # A running LLM call cannot be interrupted; its tokens are counted as waste when it lands.
+        self.future.cancel()
+        self.future.add_done_callback(self._count_waste)
+
+    @staticmethod
+    def _count_waste(future):
+        try:
+            response = future.result()
+        except Exception:
+            return
+        if response is not None:
+            _record("wasted_tokens", response_tokens(response))
+
+
+class Speculator:
+    """Drafts a reply from stable partial transcripts and commits it if the final transcript matches."""
+
+    def __init__(self, user_id, session_id, openai_api_key=None):
+        self.user_id = user_id
+        self.session_id = session_id
+        self.openai_api_key = openai_api_key
+        self.config = {"configurable": {"thread_id": session_id}}
+        self.draft = None
+        self._last_partial = None
+        self._repeats = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def available():
+        return SPECULATION_ENABLED and checkpointer is not None
+
+    def _generate(self, text):
+        therapy_app = get_therapy_app(self.openai_api_key)
+        values = therapy_app.get_state(self.config).values or {}
+        state = {
+            "messages": list(values.get("messages", [])) + [HumanMessage(content=text)],
+            "user_id": self.user_id,
+        }
+        return draft_turn(state, self.openai_api_key)
+
+    def partial(self, text, stable=False):
+        words = normalize(text)
+        with self._lock:
+            if words == self._last_partial:
+                self._repeats += 1
+            else:
+                self._last_partial, self._repeats = words, 1
+            stable = stable or self._repeats >= SPECULATION_STABLE_PARTIALS
+            if not stable or len(words) < SPECULATION_MIN_WORDS or detect_crisis(text)[0]:
+                return False
+            if self.draft and transcript_similarity(self.draft.text, text) >= SPECULATION_MATCH_THRESHOLD:
+                return False
+            if self.draft:
+                self.draft.discard()
+            self.draft = Draft(text, _executor.submit(self._generate, text))
+        _record("started")
+        logger.info("speculating for %s on %r", self.session_id, text)
+        return True
+
+    def cancel(self):
+        with self._lock:
+            draft, self.draft = self.draft, None
+            self._last_partial, self._repeats = None, 0
+        if draft:
+            draft.discard()
+
+    def finalize(self, text):
+        with self._lock:
+            draft, self.draft = self.draft, None
+            self._last_partial, self._repeats = None, 0
+        if draft is None:
+            return None
+
+        if detect_crisis(text)[0] or transcript_similarity(draft.text, text) < SPECULATION_MATCH_THRESHOLD:
+            draft.discard()
+            _record("misses")
+            return None
+
+        try:
+            response = draft.future.result()
+        except Exception as e:
+            logger.warning("speculative draft failed for %s: %s", self.session_id, e)
+            response = None
+        if response is None or not response.content:
+            _record("misses")
+            return None
+
+        therapy_app = get_therapy_app(self.openai_api_key)
+        try:
+            therapy_app.update_state(
+                self.config,
+                {"messages": [HumanMessage(content=text), response], "user_id": self.user_id, "crisis": False},
+                as_node="store_memories",
+            )
+        except Exception as e:
+            logger.warning("could not commit speculative draft for %s: %s", self.session_id, e)
+            _record("misses")
+            _record("wasted_tokens", response_tokens(response))
+            return None
+        # Committed as the last node, so the thread is finished and no second run races the next turn.
+        # store_memories only queues the write, exactly as at the end of a normal turn.
+        try:
+            store_memories(therapy_app.get_state(self.config).values, get_memory(self.openai_api_key))
+        except Exception as e:
+            logger.warning("storing memories for speculative turn %s failed: %s", self.session_id, e)
+
+        _record("hits")
+        _record("used_tokens", response_tokens(response))
+        return response.content
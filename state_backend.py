@@ -0,0 +1,261 @@
+from dotenv import load_dotenv
+from multiprocessing import Pool
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from urllib.parse import urlsplit
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_DB = os.getenv("CHECKPOINT_DB", "checkpoints.sqlite")
+DEFAULT_CHECKPOINT_URL = f"sqlite:///{CHECKPOINT_DB}"
+CHECKPOINT_URL = os.getenv("CHECKPOINT_URL", DEFAULT_CHECKPOINT_URL)
+SESSION_STORE_URL = os.getenv("SESSION_STORE_URL", "sqlite:///sessions.sqlite")
+SESSION_TTL = int(os.getenv("SESSION_TTL", str(7 * 86400)))
+SQLITE_BUSY_TIMEOUT = float(os.getenv("SQLITE_BUSY_TIMEOUT", "30"))
+
+
+def create_session_id(user_id):
+    return f"session_{user_id}_{str(uuid.uuid4())[:8]}"
+
+def sqlite_path(url):
+    return url[len("sqlite:///"):] if url.startswith("sqlite:///") else url
+
+def connect_sqlite(path):
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=SQLITE_BUSY_TIMEOUT)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+def redact_url(url):
+    parts = urlsplit(url)
+    if not parts.password:
+        return url
+    return parts._replace(netloc=parts.netloc.replace(f":{parts.password}@", ":***@", 1)).geturl()
+
+def create_checkpointer(url=CHECKPOINT_URL):
+    try:
+        if url.startswith(("postgres://", "postgresql://")):
+            from psycopg import Connection
+            from psycopg.rows import dict_row
+            from langgraph.checkpoint.postgres import PostgresSaver
+
+            conn = Connection.connect(url, autocommit=True, prepare_threshold=0, row_factory=dict_row)
+            saver = PostgresSaver(conn)
+            saver.setup()
+            return saver
+
+        from langgraph.checkpoint.sqlite import SqliteSaver
+        return SqliteSaver(connect_sqlite(sqlite_path(url)))
+    except Exception as e:
+        logger.exception("could not open checkpointer at %s", redact_url(url))
+        # An explicitly configured backend that fails is a misconfiguration, not a reason to run without history.
+        if url != DEFAULT_CHECKPOINT_URL:
+            raise
+        return None
+
+
+class SqliteSessionStore:
+    def __init__(self, path, ttl=SESSION_TTL):
+        self.ttl = ttl
+        self.conn = connect_sqlite(path)
+        self.lock = threading.Lock()
+        with self.lock:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "token TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS user_threads ("
+                "user_id TEXT NOT NULL, session_id TEXT NOT NULL, updated_at REAL NOT NULL, "
+                "PRIMARY KEY (user_id, session_id))"
+            )
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS user_threads_recent ON user_threads (user_id, updated_at)"
+            )
+            self.conn.commit()
+
+    def save(self, token, data):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO sessions (token, data, updated_at) VALUES (?, ?, ?)",
+                (token, json.dumps(data), time.time()),
+            )
+            self.conn.commit()
+
+    def load(self, token):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT data FROM sessions WHERE token = ? AND updated_at > ?",
+                (token, time.time() - self.ttl),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def touch(self, token):
+        with self.lock:
+            self.conn.execute("UPDATE sessions SET updated_at = ? WHERE token = ?", (time.time(), token))
+            self.conn.commit()
+
+    def delete(self, token):
+        with self.lock:
+            self.conn.execute("DELETE FROM sessions WHERE token = ?", (token,))
+            self.conn.commit()
+
+    def record_thread(self, user_id, session_id):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO user_threads (user_id, session_id, updated_at) VALUES (?, ?, ?)",
+                (user_id, session_id, time.time()),
+            )
+            self.conn.commit()
+
+    def list_threads(self, user_id, limit=20):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT session_id FROM user_threads WHERE user_id = ? ORDER BY updated_at DESC LIMIT ?",
+                (user_id, limit),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def owns_thread(self, user_id, session_id):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT 1 FROM user_threads WHERE user_id = ? AND session_id = ?",
+                (user_id, session_id),
+            ).fetchone()
+        return row is not None
+
+    def latest_thread(self, user_id):
+        threads = self.list_threads(user_id, limit=1)
+        return threads[0] if threads else None
+
+
+class RedisSessionStore:
+    def __init__(self, url, ttl=SESSION_TTL):
+        import redis
+
+        self.ttl = ttl
+        self.client = redis.Redis.from_url(url)
+
+    def _key(self, token):
+        return f"therapy:session:{token}"
+
+    def save(self, token, data):
+        self.client.set(self._key(token), json.dumps(data), ex=self.ttl)
+
+    def load(self, token):
+        value = self.client.get(self._key(token))
+        return json.loads(value) if value else None
+
+    def touch(self, token):
+        self.client.expire(self._key(token), self.ttl)
+
+    def delete(self, token):
+        self.client.delete(self._key(token))
+
+    def _threads_key(self, user_id):
+        return f"therapy:user:{user_id}:threads"
+
+    def record_thread(self, user_id, session_id):
+        self.client.zadd(self._threads_key(user_id), {session_id: time.time()})
+
+    def list_threads(self, user_id, limit=20):
+        return [value.decode() for value in self.client.zrevrange(self._threads_key(user_id), 0, limit - 1)]
+
+    def owns_thread(self, user_id, session_id):
+        return self.client.zscore(self._threads_key(user_id), session_id) is not None
+
+    def latest_thread(self, user_id):
+        threads = self.list_threads(user_id, limit=1)
+        return threads[0] if threads else None
+
+
+def create_session_store(url=SESSION_STORE_URL):
+    if url.startswith(("redis://", "rediss://")):
+        return RedisSessionStore(url)
+    return SqliteSessionStore(sqlite_path(url))
+
+_session_store = None
+_session_store_lock = threading.Lock()
+
+def get_session_store():
+    global _session_store
+    with _session_store_lock:
+        if _session_store is None:
+            _session_store = create_session_store()
+        return _session_store
+
+
+def _bench_worker(args):
+    checkpoint_url, session_url, worker, sessions, turns = args
+    from langgraph.checkpoint.base import empty_checkpoint
+
+    saver = create_checkpointer(checkpoint_url)
+    store = create_session_store(session_url)
+    operations = 0
+    start = time.perf_counter()
+    for i in range(sessions):
+        token = f"w{worker}-{i}"
+        store.save(token, {"user_id": f"user_{i}", "session_id": token})
+        config = {"configurable": {"thread_id": token, "checkpoint_ns": ""}}
+        for _ in range(turns):
+            checkpoint = empty_checkpoint()
+            checkpoint["channel_values"] = {"messages": ["x" * 200]}
+            config = saver.put(config, checkpoint, {"source": "loop", "step": 0}, {})
+            store.touch(token)
+            operations += 2
+    return operations, time.perf_counter() - start
+
+def _resume_worker(args):
+    checkpoint_url, session_url, worker, workers, sessions = args
+    saver = create_checkpointer(checkpoint_url)
+    store = create_session_store(session_url)
+    resumed = 0
+    other = (worker + 1) % workers
+    for i in range(sessions):
+        token = f"w{other}-{i}"
+        data = store.load(token)
+        if data and saver.get_tuple({"configurable": {"thread_id": data["session_id"], "checkpoint_ns": ""}}):
+            resumed += 1
+    return resumed
+
+def benchmark(workers=4, sessions=50, turns=5, checkpoint_url=None, session_url=None):
+    with tempfile.TemporaryDirectory() as tmp:
+        checkpoint_url = checkpoint_url or f"sqlite:///{os.path.join(tmp, 'checkpoints.sqlite')}"
+        session_url = session_url or f"sqlite:///{os.path.join(tmp, 'sessions.sqlite')}"
+        create_checkpointer(checkpoint_url).setup()
+        create_session_store(session_url)
+
+        start = time.perf_counter()
+        with Pool(workers) as pool:
+            results = pool.map(_bench_worker, [(checkpoint_url, session_url, w, sessions, turns) for w in range(workers)])
+            elapsed = time.perf_counter() - start
+            resumed = pool.map(_resume_worker, [(checkpoint_url, session_url, w, workers, sessions) for w in range(workers)])
+
+    operations = sum(ops for ops, _ in results)
+    print(f"Workers: {workers}  sessions/worker: {sessions}  turns/session: {turns}")
+    print(f"Throughput: {operations / elapsed:.0f} state writes/s ({operations} writes in {elapsed:.2f}s)")
+    print(f"Cross-worker resume: {sum(resumed)}/{workers * sessions} sessions")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared session/checkpoint state backend")
+    parser.add_argument("command", choices=["bench"])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--checkpoint-url")
+    parser.add_argument("--session-url")
+    args = parser.parse_args()
+    benchmark(args.workers, args.sessions, args.turns, args.checkpoint_url, args.session_url)
+
+if __name__ == "__main__":
+    main()
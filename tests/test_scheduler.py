@@ -0,0 +1,92 @@
+import threading
+import time
+import pytest
+import scheduler
+from scheduler import BACKGROUND, INTERACTIVE, ProviderScheduler, SimulatedProvider, SimulatedRateLimit, simulate
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out waiting for the scheduler")
+        time.sleep(0.005)
+
+def serve_in_order(calls):
+    # Holds the only slot with a blocking call, queues `calls` one at a time, then lets them drain.
+    provider = ProviderScheduler("test", 1e6, 1e9, max_concurrency=1, burst_seconds=1.0)
+    started, release = threading.Event(), threading.Event()
+    order = []
+
+    def blocker():
+        started.set()
+        release.wait()
+
+    threads = [threading.Thread(target=provider.run, args=(blocker,), kwargs={"session": "blocker"})]
+    threads[0].start()
+    started.wait()
+    for count, (label, session, priority) in enumerate(calls, 1):
+        thread = threading.Thread(
+            target=provider.run,
+            args=(lambda label=label: order.append(label),),
+            kwargs={"session": session, "priority": priority},
+        )
+        thread.start()
+        threads.append(thread)
+        wait_until(lambda: sum(provider.metrics()["queued"].values()) == count)
+    release.set()
+    for thread in threads:
+        thread.join()
+    return order
+
+
+def test_interactive_calls_are_served_before_background():
+    order = serve_in_order([
+        ("background-1", "a", BACKGROUND),
+        ("background-2", "b", BACKGROUND),
+        ("interactive-1", "c", INTERACTIVE),
+        ("interactive-2", "d", INTERACTIVE),
+    ])
+    assert order == ["interactive-1", "interactive-2", "background-1", "background-2"]
+
+def test_sessions_are_served_round_robin():
+    order = serve_in_order(
+        [(f"a{i}", "a", INTERACTIVE) for i in range(3)] + [(f"b{i}", "b", INTERACTIVE) for i in range(3)]
+    )
+    assert order == ["a0", "b0", "a1", "b1", "a2", "b2"]
+
+def test_rate_limited_call_is_retried_without_rerunning_the_caller(monkeypatch):
+    monkeypatch.setattr(scheduler, "RATE_LIMIT_BACKOFF", 0.4)
+    provider = SimulatedProvider(requests_per_second=1, latency=0)
+    limits = ProviderScheduler("test", 6000, 1e9, max_concurrency=1, burst_seconds=1.0)
+    provider.call()  # fills the provider's one-second window
+    node_runs = []
+
+    def node():
+        # Stands in for a graph node: it must run once even though its provider call is retried.
+        node_runs.append(1)
+        return limits.run(provider.call, session="a")
+
+    assert node() is True
+    assert len(node_runs) == 1
+    assert provider.rejected == 2
+    assert limits.metrics()["rate_limited"] == 2
+    assert limits.metrics()["completed"] == 1
+
+def test_rate_limit_retries_are_bounded(monkeypatch):
+    monkeypatch.setattr(scheduler, "RATE_LIMIT_BACKOFF", 0.0)
+    limits = ProviderScheduler("test", 6000, 1e9, max_concurrency=1, burst_seconds=1.0)
+    attempts = []
+
+    def always_limited():
+        attempts.append(1)
+        raise SimulatedRateLimit("429 Too Many Requests")
+
+    with pytest.raises(SimulatedRateLimit):
+        limits.run(always_limited)
+    assert len(attempts) == scheduler.RATE_LIMIT_RETRIES + 1
+
+def test_simulated_burst_has_no_failures_with_scheduler():
+    result = simulate(sessions=5, calls_per_session=4, provider_rps=10, use_scheduler=True)
+    assert result["failures"] == 0
+    assert len(result["latencies"][INTERACTIVE]) + len(result["latencies"][BACKGROUND]) == 20
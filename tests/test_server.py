@@ -0,0 +1,59 @@
+import asyncio
+import json
+import pytest
+
+pytest.importorskip("tornado")
+fake_chat_models = pytest.importorskip("langchain_core.language_models.fake_chat_models")
+sqlite_checkpoint = pytest.importorskip("langgraph.checkpoint.sqlite")
+
+REPLY = "That sounds really hard. What happened today?"
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    # The default checkpoint and session databases are relative paths, so keep them out of the repo.
+    monkeypatch.chdir(tmp_path)
+    server = pytest.importorskip("server")
+    import graph
+    from state_backend import connect_sqlite
+
+    saver = sqlite_checkpoint.SqliteSaver(connect_sqlite(str(tmp_path / "turns.sqlite")))
+    llm = fake_chat_models.FakeListChatModel(responses=[REPLY])
+    monkeypatch.setattr(server, "get_therapy_app", lambda openai_api_key=None: graph.build_graph(llm, None, saver))
+    server.saver = saver
+    return server
+
+def post_turn(server, payload, headers):
+    from tornado.httpclient import AsyncHTTPClient
+    from tornado.httpserver import HTTPServer
+    from tornado.testing import bind_unused_port
+
+    async def post():
+        sock, port = bind_unused_port()
+        http_server = HTTPServer(server.make_app())
+        http_server.add_sockets([sock])
+        try:
+            return await AsyncHTTPClient().fetch(
+                f"http://127.0.0.1:{port}/v1/turn", method="POST", body=json.dumps(payload),
+                headers=headers, raise_error=False,
+            )
+        finally:
+            http_server.stop()
+
+    return asyncio.run(post())
+
+
+def test_turn_is_answered_with_the_sync_checkpointer(server):
+    response = post_turn(
+        server, {"user_id": "alex", "message": "I had an awful day at work."}, {"Authorization": "Bearer test"}
+    )
+
+    assert response.code == 200
+    body = json.loads(response.body)
+    assert body["success"] and body["response"] == REPLY
+    saved = server.saver.get_tuple({"configurable": {"thread_id": body["session_id"]}})
+    assert [m.content for m in saved.checkpoint["channel_values"]["messages"]][-1] == REPLY
+
+def test_turn_without_key_is_refused(server):
+    response = post_turn(server, {"user_id": "alex", "message": "hello"}, {})
+    assert response.code == 401
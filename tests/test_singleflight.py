@@ -0,0 +1,185 @@
+import threading
+import time
+import pytest
+from singleflight import SingleFlight, content_key
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out waiting for callers to join")
+        time.sleep(0.005)
+
+class Upstream:
+    """A chunked upstream that records how often it was opened and whether it was closed."""
+
+    def __init__(self, chunks, fail_after=None, delay=0.0):
+        self.chunks = chunks
+        self.fail_after = fail_after
+        self.delay = delay
+        self.opened = 0
+        self.closed = False
+
+    def open(self):
+        self.opened += 1
+        return self._generate()
+
+    def _generate(self):
+        try:
+            for index, chunk in enumerate(self.chunks):
+                if index == self.fail_after:
+                    raise ConnectionError("upstream dropped")
+                time.sleep(self.delay)
+                yield chunk
+        finally:
+            self.closed = True
+
+
+def test_content_key_separates_parts():
+    assert content_key("ab", "c") != content_key("a", "bc")
+    assert content_key("tts", "key", "hello") == content_key("tts", "key", "hello")
+
+def test_concurrent_calls_share_one_upstream_call():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls, results = [], []
+
+    def fn():
+        calls.append(1)
+        release.wait()
+        return "audio"
+
+    threads = [threading.Thread(target=lambda: results.append(flight.do("k", fn))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    wait_until(lambda: flight.stats()["coalesced"] == 3)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert calls == [1]
+    assert results == ["audio"] * 4
+    assert flight.stats() == {"upstream": 1, "coalesced": 3, "in_flight": 0}
+
+def test_errors_reach_every_waiting_caller():
+    flight = SingleFlight()
+    release = threading.Event()
+    errors = []
+
+    def fn():
+        release.wait()
+        raise RuntimeError("quota exceeded")
+
+    def call():
+        try:
+            flight.do("k", fn)
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    threads = [threading.Thread(target=call) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    wait_until(lambda: flight.stats()["coalesced"] == 2)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert errors == ["quota exceeded"] * 3
+
+def test_finished_calls_are_not_cached():
+    flight = SingleFlight()
+    calls = []
+
+    for _ in range(2):
+        flight.do("k", lambda: calls.append(1))
+
+    assert len(calls) == 2
+
+def test_stream_readers_share_chunks():
+    flight = SingleFlight()
+    upstream = Upstream([b"a", b"b", b"c"])
+
+    first = flight.stream("k", upstream.open)
+    second = flight.stream("k", upstream.open)
+
+    assert next(first) == b"a"
+    assert list(second) == [b"a", b"b", b"c"]
+    assert list(first) == [b"b", b"c"]
+    assert upstream.opened == 1
+    assert flight.stats()["in_flight"] == 0
+
+def test_reader_joining_mid_stream_gets_every_chunk():
+    flight = SingleFlight()
+    upstream = Upstream([b"a", b"b", b"c"])
+
+    first = flight.stream("k", upstream.open)
+    assert next(first) == b"a"
+    assert next(first) == b"b"
+    late = flight.stream("k", upstream.open)
+
+    assert list(late) == [b"a", b"b", b"c"]
+    assert list(first) == [b"c"]
+    assert upstream.opened == 1
+
+def test_one_abandoned_reader_does_not_stop_the_others():
+    flight = SingleFlight()
+    upstream = Upstream([b"a", b"b", b"c"])
+
+    first = flight.stream("k", upstream.open)
+    second = flight.stream("k", upstream.open)
+    assert next(first) == b"a"
+    first.close()
+
+    assert list(second) == [b"a", b"b", b"c"]
+
+def test_upstream_is_closed_when_every_reader_abandons_it():
+    flight = SingleFlight()
+    upstream = Upstream([b"a", b"b", b"c"])
+
+    readers = [flight.stream("k", upstream.open) for _ in range(2)]
+    assert next(readers[0]) == b"a"
+    for reader in readers:
+        reader.close()
+
+    assert upstream.closed
+    assert flight.stats()["in_flight"] == 0
+    # The key is forgotten, so the next caller opens a fresh upstream.
+    assert list(flight.stream("k", upstream.open)) == [b"a", b"b", b"c"]
+    assert upstream.opened == 2
+
+def test_upstream_errors_reach_every_reader():
+    flight = SingleFlight()
+    upstream = Upstream([b"a", b"b", b"c"], fail_after=1)
+
+    first = flight.stream("k", upstream.open)
+    second = flight.stream("k", upstream.open)
+    assert next(first) == b"a"
+
+    with pytest.raises(ConnectionError):
+        list(first)
+    assert next(second) == b"a"
+    with pytest.raises(ConnectionError):
+        next(second)
+    assert flight.stats()["in_flight"] == 0
+
+def test_concurrent_readers_each_get_the_whole_stream():
+    flight = SingleFlight()
+    chunks = [bytes([i]) for i in range(20)]
+    upstream = Upstream(chunks, delay=0.005)
+    start = threading.Barrier(6)
+    results = []
+
+    def read():
+        reader = flight.stream("k", upstream.open)
+        start.wait()
+        results.append(list(reader))
+
+    threads = [threading.Thread(target=read) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert upstream.opened == 1
+    assert results == [chunks] * 6
@@ -0,0 +1,101 @@
+import itertools
+import json
+import urllib.request
+import pytest
+import tts
+from tts import TTSController, start_stub_server
+
+SLOW = {"name": "default", "model_id": "slow_model", "output_format": "mp3_44100_128", "latency": 0}
+FAST = {"name": "fast", "model_id": "fast_model", "output_format": "pcm_16000", "latency": 3}
+
+_texts = itertools.count()
+
+
+class StubClient:
+    """Just enough of the ElevenLabs client to stream from the stub server."""
+
+    def __init__(self, url):
+        self.url = url
+        self.key_digest = "stub"
+        self.text_to_speech = self
+
+    def stream(self, voice_id, text, model_id, output_format, **kwargs):
+        request = urllib.request.Request(
+            f"{self.url}/v1/text-to-speech/{voice_id}/stream?output_format={output_format}",
+            data=json.dumps({"text": text, "model_id": model_id}).encode(),
+            method="POST",
+        )
+        with urllib.request.urlopen(request) as response:
+            while chunk := response.read(1024):
+                yield chunk
+
+@pytest.fixture
+def stub():
+    servers = []
+
+    def start(**kwargs):
+        server, url = start_stub_server(chunks=2, chunk_delay=0, **kwargs)
+        servers.append(server)
+        return server, StubClient(url)
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+@pytest.fixture
+def local_engine(monkeypatch):
+    spoken = []
+    monkeypatch.setattr(tts, "local_tts_available", lambda: True)
+    monkeypatch.setattr(tts, "synthesize_local", lambda text: spoken.append(text) or b"RIFF")
+    return spoken
+
+def speak(controller, client):
+    # Distinct text per call so the single-flight layer never merges two requests.
+    mime, chunks = controller.stream(f"Let's take a breath together, number {next(_texts)}.", client)
+    return mime, b"".join(chunks)
+
+
+def test_falls_back_to_faster_profile_when_ttfb_misses_target(stub, monkeypatch):
+    monkeypatch.setattr(tts, "local_tts_available", lambda: False)
+    server, client = stub(latencies={"slow_model": 0.3}, default_latency=0.0)
+    controller = TTSController([SLOW, FAST], target_ttfb=0.15, fallback_ttfb=5.0)
+
+    mimes = [speak(controller, client)[0] for _ in range(tts.TTS_MIN_SAMPLES + 3)]
+
+    assert mimes[:tts.TTS_MIN_SAMPLES] == ["audio/mpeg"] * tts.TTS_MIN_SAMPLES
+    assert mimes[tts.TTS_MIN_SAMPLES:] == ["audio/L16;rate=16000"] * 3
+    assert controller.choose() is FAST
+    assert controller.metrics()["profiles"]["default"]["requests"] == tts.TTS_MIN_SAMPLES
+
+def test_stays_on_best_profile_when_it_meets_target(stub, monkeypatch):
+    monkeypatch.setattr(tts, "local_tts_available", lambda: False)
+    server, client = stub(default_latency=0.0)
+    controller = TTSController([SLOW, FAST], target_ttfb=0.5, fallback_ttfb=5.0)
+
+    mimes = [speak(controller, client)[0] for _ in range(tts.TTS_MIN_SAMPLES + 2)]
+
+    assert set(mimes) == {"audio/mpeg"}
+    assert controller.metrics()["profiles"]["fast"]["requests"] == 0
+
+def test_speaks_locally_when_remote_is_too_slow(stub, local_engine):
+    server, client = stub(default_latency=1.0)
+    controller = TTSController([SLOW, FAST], target_ttfb=0.1, fallback_ttfb=0.2, fallback_after=2, cooldown=60)
+
+    results = [speak(controller, client) for _ in range(3)]
+
+    assert results == [("audio/wav", b"RIFF")] * 3
+    assert len(local_engine) == 3
+    # The third call comes after the cooldown starts, so it never reaches the remote service.
+    assert server.requests == 2
+    metrics = controller.metrics()
+    assert metrics["local_fallback_active"] and metrics["fallbacks"] == 1
+    assert metrics["profile"] == tts.LOCAL
+
+def test_speaks_locally_when_remote_fails(stub, local_engine):
+    server, client = stub(default_latency=0.0, fail_after=0)
+    controller = TTSController([SLOW, FAST], fallback_ttfb=5.0, fallback_after=2)
+
+    mime, audio = speak(controller, client)
+
+    assert (mime, audio) == ("audio/wav", b"RIFF")
+    assert server.requests == 1
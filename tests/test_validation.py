@@ -0,0 +1,102 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from validation import clear_validation_cache, validate_key
+
+
+class StubModelsHandler(BaseHTTPRequestHandler):
+    """Answers every GET with the next status from the server's script."""
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            server.seen.append((self.path, dict(self.headers)))
+            status = server.statuses[min(server.requests, len(server.statuses)) - 1]
+        time.sleep(server.delay)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def stub():
+    servers = []
+
+    def start(*statuses, delay=0.0):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), StubModelsHandler)
+        server.statuses = statuses
+        server.delay = delay
+        server.requests = 0
+        server.seen = []
+        server.lock = threading.Lock()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+    clear_validation_cache()
+    yield start
+    clear_validation_cache()
+    for server in servers:
+        server.shutdown()
+
+
+def test_valid_key_is_cached(stub):
+    server, url = stub(200)
+
+    assert validate_key("openai", "sk-good", base_url=url) == (True, "OpenAI key is valid")
+    assert validate_key("openai", "sk-good", base_url=url)[0]
+    assert server.requests == 1
+    path, headers = server.seen[0]
+    assert path == "/models" and headers["Authorization"] == "Bearer sk-good"
+
+def test_rejected_key_is_cached(stub):
+    server, url = stub(401, 200)
+
+    for _ in range(2):
+        valid, message = validate_key("openai", "sk-bad", base_url=url)
+        assert not valid and "HTTP 401" in message
+    assert server.requests == 1
+
+def test_rate_limited_key_counts_as_valid_and_is_not_cached(stub):
+    server, url = stub(429, 200)
+
+    assert validate_key("openai", "sk-busy", base_url=url) == (True, "OpenAI key is valid but rate limited")
+    assert validate_key("openai", "sk-busy", base_url=url) == (True, "OpenAI key is valid")
+    assert server.requests == 2
+
+def test_other_errors_are_not_cached(stub):
+    server, url = stub(404, 200)
+
+    assert not validate_key("openai", "sk-key", base_url=url)[0]
+    assert validate_key("openai", "sk-key", base_url=url)[0]
+    assert server.requests == 2
+
+def test_timeout_is_reported_and_not_cached(stub):
+    server, url = stub(200, delay=0.5)
+
+    valid, message = validate_key("openai", "sk-slow", base_url=url, timeout=0.1)
+    assert not valid and "did not respond" in message
+    server.delay = 0.0
+    assert validate_key("openai", "sk-slow", base_url=url, timeout=1.0)[0]
+
+def test_cached_result_expires(stub):
+    server, url = stub(401, 200)
+
+    assert not validate_key("openai", "sk-rotated", base_url=url, ttl=0.2)[0]
+    assert not validate_key("openai", "sk-rotated", base_url=url, ttl=0.2)[0]
+    time.sleep(0.3)
+    assert validate_key("openai", "sk-rotated", base_url=url, ttl=0.2)[0]
+    assert server.requests == 2
+
+def test_elevenlabs_probe_sends_its_key_header(stub):
+    server, url = stub(200)
+
+    assert validate_key("elevenlabs", "xi-good", base_url=url) == (True, "ElevenLabs key is valid")
+    path, headers = server.seen[0]
+    assert path == "/v1/models" and headers["xi-api-key"] == "xi-good"
@@ -0,0 +1,142 @@
+from array import array
+import argparse
+import gc
+import multiprocessing
+import os
+import sys
+import tracemalloc
+
+ROLES = ("user", "assistant")
+USER, ASSISTANT = 0, 1
+
+
+class Transcript:
+    __slots__ = ("_roles", "_contents")
+
+    def __init__(self):
+        self._roles = array("B")
+        self._contents = []
+
+    @classmethod
+    def from_messages(cls, messages):
+        transcript = cls()
+        for message in messages:
+            transcript.add_message(message)
+        return transcript
+
+    def add(self, role, content):
+        self._roles.append(ROLES.index(role))
+        self._contents.append(content)
+
+    def add_user(self, content):
+        self._roles.append(USER)
+        self._contents.append(content)
+
+    def add_assistant(self, content):
+        self._roles.append(ASSISTANT)
+        self._contents.append(content)
+
+    def add_message(self, message):
+        from langchain.schema import HumanMessage, AIMessage
+
+        if isinstance(message, HumanMessage):
+            self.add_user(message.content)
+        elif isinstance(message, AIMessage):
+            self.add_assistant(message.content)
+
+    def prepend(self, other):
+        self._roles[:0] = other._roles
+        self._contents[:0] = other._contents
+
+    def slice(self, start=None, stop=None):
+        transcript = Transcript()
+        transcript._roles = self._roles[start:stop]
+        transcript._contents = self._contents[start:stop]
+        return transcript
+
+    def clear(self):
+        self._roles = array("B")
+        self._contents = []
+
+    def last(self):
+        if not self._contents:
+            return None
+        return ROLES[self._roles[-1]], self._contents[-1]
+
+    def __len__(self):
+        return len(self._contents)
+
+    def __bool__(self):
+        return bool(self._contents)
+
+    def __iter__(self):
+        for role, content in zip(self._roles, self._contents):
+            yield ROLES[role], content
+
+    def to_messages(self, start=None, stop=None):
+        from langchain.schema import HumanMessage, AIMessage
+
+        return [
+            HumanMessage(content=content) if role == USER else AIMessage(content=content)
+            for role, content in zip(self._roles[start:stop], self._contents[start:stop])
+        ]
+
+
+def _rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+def _build_sessions(kind, sessions, messages, length):
+    from langchain.schema import HumanMessage, AIMessage
+
+    store = []
+    for s in range(sessions):
+        if kind == "transcript":
+            history = Transcript()
+            for m in range(messages):
+                (history.add_user if m % 2 == 0 else history.add_assistant)(f"{s}:{m} " + "x" * length)
+        else:
+            history = [
+                (HumanMessage if m % 2 == 0 else AIMessage)(content=f"{s}:{m} " + "x" * length)
+                for m in range(messages)
+            ]
+        store.append(history)
+    return store
+
+def measure(kind, sessions, messages, length):
+    gc.collect()
+    rss_before = _rss_bytes()
+    tracemalloc.start()
+    store = _build_sessions(kind, sessions, messages, length)
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss_after = _rss_bytes()
+    del store
+    gc.collect()
+    per_message = allocated / (sessions * messages)
+    content_size = sys.getsizeof("0:0 " + "x" * length)
+    return per_message, per_message - content_size, rss_after - rss_before
+
+def benchmark(sessions=200, messages=100, length=200):
+    print(f"{sessions} sessions x {messages} messages, {length}-char contents")
+    for kind in ("langchain", "transcript"):
+        # Fresh interpreter per run so freed arenas from one run don't hide the other's RSS growth.
+        with multiprocessing.get_context("spawn").Pool(1) as pool:
+            per_message, overhead, rss = pool.apply(measure, (kind, sessions, messages, length))
+        print(f"  {kind:<10}  {per_message:7.0f} B/message  (~{overhead:5.0f} B overhead)  "
+              f"RSS +{rss / 1024 / 1024:.1f} MiB")
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory footprint of per-session transcripts")
+    parser.add_argument("command", choices=["bench"])
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=100)
+    parser.add_argument("--length", type=int, default=200)
+    args = parser.parse_args()
+    benchmark(args.sessions, args.messages, args.length)
+
+if __name__ == "__main__":
+    main()
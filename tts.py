@@ -0,0 +1,262 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from dotenv import load_dotenv
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import argparse
+import itertools
+import json
+import logging
+import os
+import statistics
+import threading
+import time
+from audio import (
+    DEFAULT_PROFILE,
+    audio_mime_type,
+    local_tts_available,
+    pcm_to_wav,
+    sniff_mime_type,
+    synthesize_local,
+    synthesize_stream,
+)
+from scheduler import INTERACTIVE
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+TTS_TARGET_TTFB = float(os.getenv("TTS_TARGET_TTFB", "0.6"))
+TTS_FALLBACK_TTFB = float(os.getenv("TTS_FALLBACK_TTFB", "2.5"))
+TTS_FALLBACK_AFTER = int(os.getenv("TTS_FALLBACK_AFTER", "2"))
+TTS_FALLBACK_COOLDOWN = float(os.getenv("TTS_FALLBACK_COOLDOWN", "60"))
+TTS_SAMPLE_TTL = float(os.getenv("TTS_SAMPLE_TTL", "300"))
+TTS_MIN_SAMPLES = int(os.getenv("TTS_MIN_SAMPLES", "3"))
+
+# Ordered from best sounding to fastest; the controller uses the first one meeting the target.
+TTS_PROFILES = json.loads(os.getenv("TTS_PROFILES", "null")) or [
+    DEFAULT_PROFILE,
+    {"name": "balanced", "model_id": "eleven_turbo_v2_5", "output_format": "mp3_22050_32", "latency": 2},
+    {"name": "fast", "model_id": "eleven_flash_v2_5", "output_format": "pcm_16000", "latency": 3},
+]
+
+LOCAL = "local"
+
+_first_byte_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="tts-first-byte")
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+class TTSController:
+    """Chooses a TTS profile from measured time to first audio byte and falls back to a local engine."""
+
+    def __init__(self, profiles=None, target_ttfb=TTS_TARGET_TTFB, fallback_ttfb=TTS_FALLBACK_TTFB,
+                 fallback_after=TTS_FALLBACK_AFTER, cooldown=TTS_FALLBACK_COOLDOWN, sample_ttl=TTS_SAMPLE_TTL):
+        self.profiles = profiles or TTS_PROFILES
+        self.target_ttfb = target_ttfb
+        self.fallback_ttfb = fallback_ttfb
+        self.fallback_after = fallback_after
+        self.cooldown = cooldown
+        self.sample_ttl = sample_ttl
+        self._samples = {profile["name"]: deque(maxlen=100) for profile in self.profiles}
+        self._requests = dict.fromkeys(list(self._samples) + [LOCAL], 0)
+        self._slow_streak = 0
+        self._fallback_until = 0.0
+        self._fallbacks = 0
+        self._lock = threading.Lock()
+
+    def _recent(self, name, now):
+        return [ttfb for at, ttfb in self._samples[name] if now - at <= self.sample_ttl]
+
+    def choose(self):
+        now = time.monotonic()
+        with self._lock:
+            if now < self._fallback_until and local_tts_available():
+                return None
+            for profile in self.profiles:
+                # Too few fresh samples means the profile is due for another try; old samples age out
+                # so a slower, better profile gets retried once the remote side recovers.
+                recent = self._recent(profile["name"], now)
+                if len(recent) < TTS_MIN_SAMPLES or percentile(recent, 0.9) <= self.target_ttfb:
+                    return profile
+            return self.profiles[-1]
+
+    def observe(self, profile, ttfb=None, error=None):
+        now = time.monotonic()
+        slow = error is not None or ttfb is None or ttfb > self.fallback_ttfb
+        with self._lock:
+            self._requests[profile["name"]] += 1
+            self._samples[profile["name"]].append((now, self.fallback_ttfb if ttfb is None else ttfb))
+            self._slow_streak = self._slow_streak + 1 if slow else 0
+            if self._slow_streak >= self.fallback_after and local_tts_available():
+                logger.warning("remote TTS slow or failing, using local engine for %.0fs", self.cooldown)
+                self._fallback_until = now + self.cooldown
+                self._fallbacks += 1
+                self._slow_streak = 0
+
+    def _local(self):
+        with self._lock:
+            self._requests[LOCAL] += 1
+        return lambda text: ("audio/wav", iter([synthesize_local(text)]))
+
+    def _first_chunk(self, chunks):
+        if not local_tts_available():
+            return next(chunks, b"")
+        # With a local engine to fall back on, don't wait past the fallback threshold.
+        future = _first_byte_executor.submit(next, chunks, b"")
+        try:
+            return future.result(timeout=self.fallback_ttfb)
+        except FutureTimeout:
+            future.add_done_callback(lambda _: chunks.close())
+            raise
+
+    def stream(self, text, elevenlabs_client, session="default", priority=INTERACTIVE):
+        profile = self.choose()
+        if profile is None:
+            return self._local()(text)
+
+        start = time.monotonic()
+        try:
+            chunks = iter(synthesize_stream(text, elevenlabs_client, session, priority, profile))
+            first = self._first_chunk(chunks)
+        except Exception as e:
+            timed_out = isinstance(e, FutureTimeout)
+            self.observe(profile, error=None if timed_out else e)
+            if not local_tts_available():
+                raise
+            logger.warning("%s TTS %s, speaking locally", profile["name"], "too slow" if timed_out else f"failed: {e}")
+            return self._local()(text)
+
+        self.observe(profile, time.monotonic() - start)
+        return audio_mime_type(profile["output_format"]), itertools.chain([first], chunks)
+
+    def speech(self, text, elevenlabs_client, session="default", priority=INTERACTIVE):
+        mime, chunks = self.stream(text, elevenlabs_client, session, priority)
+        audio = b"".join(chunk for chunk in chunks if chunk)
+        if mime.startswith("audio/L16"):
+            audio = pcm_to_wav(audio, "pcm_" + mime.partition("rate=")[2])
+        return audio, sniff_mime_type(audio, mime)
+
+    def metrics(self):
+        now = time.monotonic()
+        with self._lock:
+            profiles = {}
+            for name, count in self._requests.items():
+                recent = self._recent(name, now) if name in self._samples else []
+                profiles[name] = {
+                    "requests": count,
+                    "ttfb_p50": statistics.median(recent) if recent else None,
+                    "ttfb_p90": percentile(recent, 0.9) if recent else None,
+                }
+            local_active = now < self._fallback_until
+        chosen = self.choose()
+        return {
+            "profile": LOCAL if chosen is None else chosen["name"],
+            "local_fallback_active": local_active,
+            "fallbacks": self._fallbacks,
+            "profiles": profiles,
+        }
+
+
+controller = TTSController()
+
+def speak_stream(text, elevenlabs_client, session="default", priority=INTERACTIVE):
+    return controller.stream(text, elevenlabs_client, session, priority)
+
+def speak_audio(text, elevenlabs_client, session="default", priority=INTERACTIVE):
+    return controller.speech(text, elevenlabs_client, session, priority)
+
+def get_tts_metrics():
+    return controller.metrics()
+
+
+class StubTTSHandler(BaseHTTPRequestHandler):
+    """Minimal stand-in for the ElevenLabs text-to-speech endpoints with injected latency."""
+
+    def do_POST(self):
+        server = self.server
+        path = urlparse(self.path)
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        with server.lock:
+            server.requests += 1
+            failing = server.fail_after is not None and server.requests > server.fail_after
+        if "/v1/text-to-speech/" not in path.path or failing:
+            self.send_error(503 if failing else 404)
+            return
+
+        output_format = parse_qs(path.query).get("output_format", ["mp3_22050_32"])[0]
+        time.sleep(server.latencies.get(body.get("model_id"), server.default_latency))
+        prefix = b"" if output_format.startswith("pcm") else b"ID3"
+        chunk = b"\0" * 1024
+        self.send_response(200)
+        self.send_header("Content-Type", audio_mime_type(output_format))
+        self.send_header("Content-Length", str(len(prefix) + len(chunk) * server.chunks))
+        self.end_headers()
+        self.wfile.write(prefix)
+        for _ in range(server.chunks):
+            self.wfile.write(chunk)
+            self.wfile.flush()
+            time.sleep(server.chunk_delay)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_stub_server(latencies=None, default_latency=0.3, chunks=8, chunk_delay=0.02, fail_after=None, port=0):
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubTTSHandler)
+    server.latencies = latencies or {}
+    server.default_latency = default_latency
+    server.chunks = chunks
+    server.chunk_delay = chunk_delay
+    server.fail_after = fail_after
+    server.requests = 0
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+def benchmark(requests=30, latencies=None, default_latency=0.3, fail_after=None, target_ttfb=TTS_TARGET_TTFB):
+    from elevenlabs.client import ElevenLabs
+
+    server, url = start_stub_server(latencies, default_latency, fail_after=fail_after)
+    client = ElevenLabs(api_key="stub", base_url=url)
+    tts = TTSController(target_ttfb=target_ttfb, fallback_ttfb=max(target_ttfb * 4, 1.0), cooldown=5)
+    ttfbs, formats = [], []
+    try:
+        for i in range(requests):
+            start = time.monotonic()
+            try:
+                mime, chunks = tts.stream(f"Take a slow breath with me, number {i}.", client)
+                next(chunks, None)
+                ttfbs.append(time.monotonic() - start)
+                formats.append(mime)
+                for _ in chunks:
+                    pass
+            except Exception as e:
+                print(f"request {i} failed: {e}")
+    finally:
+        server.shutdown()
+
+    print(f"{requests} requests against stub at {url}, target TTFB {target_ttfb:.2f}s")
+    if ttfbs:
+        print(f"  client TTFB  p50 {statistics.median(ttfbs):.2f}s  p90 {percentile(ttfbs, 0.9):.2f}s")
+    for mime in sorted(set(formats)):
+        print(f"  {mime:<24} {formats.count(mime)} requests")
+    print(json.dumps(tts.metrics(), indent=2))
+
+def main():
+    parser = argparse.ArgumentParser(description="Adaptive TTS against a stub server with injected latency")
+    parser.add_argument("command", choices=["bench"])
+    parser.add_argument("--requests", type=int, default=30)
+    parser.add_argument("--latency", action="append", default=[], metavar="MODEL=SECONDS",
+                        help="per-model time to first byte, e.g. eleven_turbo_v2=1.2")
+    parser.add_argument("--default-latency", type=float, default=0.3)
+    parser.add_argument("--fail-after", type=int, help="stub returns 503 after this many requests")
+    parser.add_argument("--target-ttfb", type=float, default=TTS_TARGET_TTFB)
+    args = parser.parse_args()
+    latencies = {model: float(seconds) for model, _, seconds in (item.partition("=") for item in args.latency)}
+    benchmark(args.requests, latencies, args.default_latency, args.fail_after, args.target_ttfb)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+import os
+import threading
+import time
+import httpx
+from clients import OPENAI_BASE_URL, ELEVENLABS_BASE_URL, get_http_client, key_digest
+
+load_dotenv()
+
+KEY_VALIDATION_TIMEOUT = float(os.getenv("KEY_VALIDATION_TIMEOUT", "5"))
+KEY_VALIDATION_TTL = float(os.getenv("KEY_VALIDATION_TTL", "600"))
+
+_results = {}
+_results_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="validate")
+
+
+def _probe(name, url, headers, timeout):
+    try:
+        response = get_http_client().get(url, headers=headers, timeout=timeout)
+    except httpx.TimeoutException:
+        return False, f"{name} did not respond within {timeout:g}s", False
+    except httpx.HTTPError as e:
+        return False, f"{name} unreachable: {str(e)}", False
+
+    # Only definite answers are cached; anything else is probed again on the next call.
+    if response.status_code == 200:
+        return True, f"{name} key is valid", True
+    if response.status_code in (401, 403):
+        return False, f"{name} rejected the API key (HTTP {response.status_code})", True
+    if response.status_code == 429:
+        return True, f"{name} key is valid but rate limited", False
+    return False, f"{name} returned HTTP {response.status_code}", False
+
+def probe_openai(api_key, base_url=None, timeout=KEY_VALIDATION_TIMEOUT):
+    url = f"{(base_url or OPENAI_BASE_URL).rstrip('/')}/models"
+    return _probe("OpenAI", url, {"Authorization": f"Bearer {api_key}"}, timeout)
+
+def probe_elevenlabs(api_key, base_url=None, timeout=KEY_VALIDATION_TIMEOUT):
+    url = f"{(base_url or ELEVENLABS_BASE_URL).rstrip('/')}/v1/models"
+    return _probe("ElevenLabs", url, {"xi-api-key": api_key}, timeout)
+
+
+PROBES = {
+    "openai": probe_openai,
+    "elevenlabs": probe_elevenlabs,
+}
+
+def validate_key(provider, api_key, base_url=None, timeout=KEY_VALIDATION_TIMEOUT, ttl=KEY_VALIDATION_TTL):
+    cache_key = (provider, base_url, key_digest(api_key))
+    now = time.monotonic()
+
+    with _results_lock:
+        cached = _results.get(cache_key)
+        if cached and cached[0] > now:
+            return cached[1], cached[2]
+
+    valid, message, cacheable = PROBES[provider](api_key, base_url=base_url, timeout=timeout)
+
+    if cacheable:
+        with _results_lock:
+            _results[cache_key] = (now + ttl, valid, message)
+            for key in [k for k, v in _results.items() if v[0] <= now]:
+                del _results[key]
+
+    return valid, message
+
+def validate_api_keys(openai_key, elevenlabs_key, base_urls=None, timeout=KEY_VALIDATION_TIMEOUT):
+    base_urls = base_urls or {}
+    keys = {"openai": openai_key, "elevenlabs": elevenlabs_key}
+    futures = {
+        provider: _executor.submit(validate_key, provider, key, base_urls.get(provider), timeout)
+        for provider, key in keys.items() if key
+    }
+    return {provider: future.result() for provider, future in futures.items()}
+
+def clear_validation_cache():
+    with _results_lock:
+        _results.clear()